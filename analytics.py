@@ -1,5 +1,390 @@
-from db_manager import HabitDatabase
-from datetime import datetime, timedelta
+from db_manager import HabitDatabase, SCHEMA_VERSION, read_only_uri
+from lru import LRUCache
+from timestamps import decode_epoch, encode_completion, month_ordinal, parse_day_ordinal, week_ordinal
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from glob import glob, has_magic
+from array import array
+from bisect import bisect_left
+from itertools import chain, groupby
+from itertools import repeat
+from operator import itemgetter, sub
+import os
+import sqlite3
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional; without it the array engine walks the periods like the python engine
+    numpy = None
+
+# Habit ID ranges per worker process in parallel mode, so that a slow range does not
+# leave the other workers idle.
+PARALLEL_CHUNKS_PER_WORKER = 4
+
+# Database files attached to one connection in fleet analytics; SQLite allows 10 by default.
+FLEET_ATTACH_GROUP_SIZE = 8
+
+# One database's share of a fleet summary, read from its schema `{schema}` in a single
+# statement: habit counts per periodicity, the number of completions, and the habit
+# with the longest streak according to habit_streak_state.
+_FLEET_SUMMARY_SQL = """
+SELECT {index}, 'habits', periodicity, NULL, COUNT(*) FROM {schema}.habits GROUP BY periodicity
+UNION ALL
+SELECT {index}, 'completions', NULL, NULL, COUNT(*) FROM {schema}.completion_dates
+UNION ALL
+SELECT * FROM (
+    SELECT {index}, 'streak', h.periodicity, s.habit_id, s.longest_run
+    FROM {schema}.habit_streak_state AS s JOIN {schema}.habits AS h ON h.id = s.habit_id
+    ORDER BY s.longest_run DESC, s.habit_id LIMIT 1
+)
+"""
+
+# Marks a value missing from the in-process cache, where None is a valid value.
+_MISSING = object()
+
+# Ways of computing longest streaks; see Analytics.get_longest_streaks.
+STREAK_ENGINES = ("state", "python", "array", "sql", "bitmap", "stream")
+DEFAULT_STREAK_ENGINE = "state"
+
+
+def _longest_run_numpy(periods):
+    """Longest run of consecutive ordinals, using NumPy's unique, diff and flatnonzero."""
+    values = numpy.unique(numpy.asarray(periods, dtype=numpy.int64))  # Sorted and deduplicated
+    if values.size == 0:
+        return 0
+    # Indexes where a run ends, bracketed by the positions before the first and of the last value
+    run_ends = numpy.concatenate(([-1], numpy.flatnonzero(numpy.diff(values) != 1), [values.size - 1]))
+    return int(numpy.diff(run_ends).max())
+
+
+# The array engine uses NumPy when it is installed. A pure-Python "vectorized" version
+# (sorted(set()) into an array, then map/compress pipelines) was slower than the plain
+# loop of Analytics._longest_run and copied the input; see benchmarks/bench_streak_engines.py.
+longest_run_vectorized = _longest_run_numpy if numpy is not None else None
+
+
+def habit_id_ranges(habit_ids, chunks):
+    """
+    Split habit IDs into contiguous (first, last) ranges holding about the same number of habits.
+
+    Args:
+        habit_ids (iterable): The habit IDs.
+        chunks (int): How many ranges to make at most.
+
+    Returns:
+        list: (first, last) tuples in ascending order, inclusive.
+    """
+    habit_ids = sorted(habit_ids)
+    chunks = max(min(chunks, len(habit_ids)), 1)
+    bounds = [len(habit_ids) * index // chunks for index in range(chunks + 1)]
+    return [(habit_ids[start], habit_ids[end - 1]) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def _longest_streaks_in_range(db_name, id_range):
+    """
+    Worker process: longest streaks of a range of habits over a read-only connection of its own.
+
+    Returns:
+        tuple: (write version of the habit set, sorted (habit_id, streak) pairs), both read
+        from the same snapshot.
+    """
+    db = HabitDatabase(db_name, read_only=True)
+    try:
+        with db.transaction():
+            version = db.get_write_version(0)
+            return version, sorted(Analytics(db, cache=False)._stream_longest_streaks(id_range=id_range).items())
+    finally:
+        db.close()
+
+
+def expand_database_paths(paths):
+    """
+    Turn database paths and glob patterns into a sorted list of existing files.
+
+    Args:
+        paths (str or iterable): A path or glob pattern, or several of them.
+
+    Returns:
+        list: The matching file paths, sorted and without duplicates.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    found = set()
+    for path in paths:
+        if has_magic(path):
+            found.update(match for match in glob(path) if os.path.isfile(match))
+        elif os.path.isfile(path):
+            found.add(path)
+        else:
+            raise ValueError(f"No database file at {path}.")
+    if not found:
+        raise ValueError("No database files match the given paths.")
+    return sorted(found)
+
+
+def _summarize_database_group(paths):
+    """
+    Summarize a few database files through one connection that ATTACHes them all read-only.
+
+    Returns:
+        list: One summary dict per path, in the same order; see _merge_fleet_summaries.
+    """
+    conn = sqlite3.connect(":memory:", uri=True)
+    try:
+        selects = []
+        for index, path in enumerate(paths):
+            schema = f"fleet{index}"
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (read_only_uri(path),))
+            version = conn.execute(f"PRAGMA {schema}.user_version").fetchone()[0]
+            if version < SCHEMA_VERSION:
+                raise ValueError(f"{path} is at schema version {version}, not {SCHEMA_VERSION}; "
+                                 "run any command on it to migrate it.")
+            selects.append(_FLEET_SUMMARY_SQL.format(index=index, schema=schema))
+
+        summaries = [{"path": path, "habits_by_periodicity": {}, "completions": 0,
+                      "longest_streak": 0, "longest_streak_habit": None} for path in paths]
+        for index, kind, periodicity, habit_id, value in conn.execute(" UNION ALL ".join(selects)):
+            summary = summaries[index]
+            if kind == "habits":
+                summary["habits_by_periodicity"][periodicity] = value
+            elif kind == "completions":
+                summary["completions"] = value
+            else:
+                summary["longest_streak"] = value
+                summary["longest_streak_habit"] = (summary["path"], habit_id, periodicity)
+        return summaries
+    finally:
+        conn.close()
+
+
+def _merge_fleet_summaries(summaries):
+    """Reduce per-database summaries, in path order, into fleet-wide totals."""
+    habits_by_periodicity = Counter()
+    fleet = {"databases": 0, "habits": 0, "habits_by_periodicity": {}, "completions": 0,
+             "longest_streak": 0, "longest_streak_habit": None}
+    for summary in summaries:
+        fleet["databases"] += 1
+        habits_by_periodicity.update(summary["habits_by_periodicity"])
+        fleet["completions"] += summary["completions"]
+        # Strictly longer only, so that ties go to the first database in path order
+        if summary["longest_streak"] > fleet["longest_streak"]:
+            fleet["longest_streak"] = summary["longest_streak"]
+            fleet["longest_streak_habit"] = summary["longest_streak_habit"]
+    fleet["habits"] = sum(habits_by_periodicity.values())
+    fleet["habits_by_periodicity"] = dict(sorted(habits_by_periodicity.items()))
+    return fleet
+
+
+class Metric:
+    """
+    A per-habit statistic computed in a single pass over the habit's completions.
+
+    update() is called with the day ordinal of every completion, oldest first, and
+    result() returns the value once they have all been seen. Metrics are small and
+    independent, so any selection of them can share one traversal.
+    """
+
+    name = None
+
+    def __init__(self, periodicity, today):
+        """
+        Args:
+            periodicity (str): The habit's periodicity, "daily" or "weekly".
+            today (int): Day ordinal that metrics relative to the present are measured at.
+        """
+        self.periodicity = periodicity
+        self.today = today
+
+    def period(self, day_ordinal):
+        """The day ordinal itself for daily habits, its ISO-week ordinal for weekly ones."""
+        return week_ordinal(day_ordinal) if self.periodicity == "weekly" else day_ordinal
+
+    def update(self, day_ordinal):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class LongestStreak(Metric):
+    """Longest run of consecutive periods with a completion."""
+
+    name = "longest_streak"
+
+    def __init__(self, periodicity, today):
+        super().__init__(periodicity, today)
+        self.previous = None
+        self.run = self.longest = 0
+
+    def update(self, day_ordinal):
+        period = self.period(day_ordinal)
+        if period == self.previous:
+            return
+        self.run = self.run + 1 if self.previous is not None and period == self.previous + 1 else 1
+        self.longest = max(self.longest, self.run)
+        self.previous = period
+
+    def result(self):
+        return self.longest
+
+
+class CurrentStreak(LongestStreak):
+    """Run still alive today: it must end in the current or the previous period."""
+
+    name = "current_streak"
+
+    def result(self):
+        if self.previous is None or self.previous < self.period(self.today) - 1:
+            return 0
+        return self.run
+
+
+class TotalCompletions(Metric):
+    """Number of completions recorded."""
+
+    name = "total_completions"
+
+    def __init__(self, periodicity, today):
+        super().__init__(periodicity, today)
+        self.total = 0
+
+    def update(self, day_ordinal):
+        self.total += 1
+
+    def result(self):
+        return self.total
+
+
+class FirstCompletion(Metric):
+    """Day of the first completion, or None."""
+
+    name = "first_completion"
+
+    def __init__(self, periodicity, today):
+        super().__init__(periodicity, today)
+        self.first = None
+
+    def update(self, day_ordinal):
+        if self.first is None:
+            self.first = day_ordinal
+
+    def result(self):
+        return date.fromordinal(self.first) if self.first is not None else None
+
+
+class LastCompletion(Metric):
+    """Day of the latest completion, or None."""
+
+    name = "last_completion"
+
+    def __init__(self, periodicity, today):
+        super().__init__(periodicity, today)
+        self.last = None
+
+    def update(self, day_ordinal):
+        self.last = day_ordinal
+
+    def result(self):
+        return date.fromordinal(self.last) if self.last is not None else None
+
+
+class CompletionRate(Metric):
+    """Share of periods from the first completion up to today that have a completion."""
+
+    name = "completion_rate"
+
+    def __init__(self, periodicity, today):
+        super().__init__(periodicity, today)
+        self.first = self.previous = None
+        self.completed = 0
+
+    def update(self, day_ordinal):
+        period = self.period(day_ordinal)
+        if self.first is None:
+            self.first = period
+        if period != self.previous:
+            self.completed += 1
+            self.previous = period
+
+    def result(self):
+        if self.first is None:
+            return 0.0
+        return self.completed / max(self.period(self.today) - self.first + 1, self.completed)
+
+
+class BestWeekday(Metric):
+    """Weekday with the most completions (the earliest in the week on a tie), or None."""
+
+    name = "best_weekday"
+
+    def __init__(self, periodicity, today):
+        super().__init__(periodicity, today)
+        self.counts = Counter()
+
+    def update(self, day_ordinal):
+        self.counts[(day_ordinal - 1) % 7] += 1  # 0 is Monday
+
+    def result(self):
+        if not self.counts:
+            return None
+        weekday = min(self.counts, key=lambda day: (-self.counts[day], day))
+        return date.fromordinal(weekday + 1).strftime("%A")
+
+
+# Metrics available to Analytics.get_habit_stats, by name.
+METRICS = {metric.name: metric for metric in (
+    LongestStreak, CurrentStreak, TotalCompletions, FirstCompletion, LastCompletion, CompletionRate, BestWeekday)}
+
+
+class CompletionTimeline:
+    """
+    A habit's completion times held in memory as a sorted array of epoch seconds.
+
+    After one read from the database, every window query is a pair of binary searches,
+    which suits reports that look at many windows of the same history.
+    """
+
+    def __init__(self, epochs):
+        """
+        Args:
+            epochs (iterable of int): Completion times as epoch seconds, in ascending order.
+        """
+        self.epochs = array("q", epochs)
+
+    @classmethod
+    def from_db(cls, db, habit_id):
+        """Load the timeline of a habit."""
+        return cls(db.get_completion_epochs(habit_id))
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def _position(self, moment):
+        """Index of the first completion at or after a datetime or "YYYY-MM-DD HH:MM:SS" string."""
+        return bisect_left(self.epochs, encode_completion(moment)[0])
+
+    def count_between(self, start, end):
+        """Number of completions from start (inclusive) to end (exclusive)."""
+        return max(self._position(end) - self._position(start), 0)
+
+    def between(self, start, end):
+        """Completions from start (inclusive) to end (exclusive), as datetimes."""
+        return [decode_epoch(epoch) for epoch in self.epochs[self._position(start):self._position(end)]]
+
+    def count_windows(self, boundaries):
+        """
+        Count the completions in consecutive windows.
+
+        Args:
+            boundaries (list): Ascending datetimes; window i runs from boundaries[i]
+                (inclusive) to boundaries[i + 1] (exclusive).
+
+        Returns:
+            list: One count per window.
+        """
+        positions = [self._position(boundary) for boundary in boundaries]
+        return list(map(sub, positions[1:], positions))
 
 
 class Analytics:
@@ -7,113 +392,563 @@ class Analytics:
     A class responsible for analyzing habits, such as calculating streaks.
     """
 
-    def __init__(self, db=None):
+    def __init__(self, db=None, cache=True, memo=None):
         """
         Initialize the Analytics class with a connection to the HabitDatabase.
         If no database is provided, it will create a default HabitDatabase instance.
 
         Args:
             db (HabitDatabase, optional): The database instance. Defaults to None.
+            cache (bool, optional): Reuse streak results stored in the analytics cache
+                while the habits they depend on are unchanged. Defaults to True.
+            memo (LRUCache, optional): In-process cache of results and completion arrays,
+                keyed by (habit_id, name, write_version). Defaults to a new LRUCache.
         """
         self.db = db if db else HabitDatabase()  # If no db is passed, use HabitDatabase()
+        self.cache = cache
+        self.memo = memo if memo is not None else LRUCache()
+        self._change_token = None
+        self._versions = {}  # Write versions read since the database last changed
+
+    def _known_version(self, habit_id):
+        """
+        Return the write version of a habit if it was read since the database last changed.
 
-    def get_longest_streak(self):
+        PRAGMA data_version and the local write count tell whether anything was written
+        since, so a version read once is reused without a query until then. After a
+        rollback, the versions bumped in the rolled-back block are handed out again for
+        different data, so every in-process entry is dropped.
+        """
+        token = self.db.get_change_token()
+        if token != self._change_token:
+            if self._change_token is not None and token[2] != self._change_token[2]:
+                self.memo.clear()
+            self._change_token, self._versions = token, {}
+        return self._versions.get(habit_id)
+
+    def _cached(self, habit_id, metric, compute):
+        """
+        Return a result from the in-process or the persistent analytics cache, computing
+        and storing it on a miss.
+
+        A new process finds a result in the cache table with a single query; later
+        calls in the same process are answered from memory while nothing changed.
+        """
+        if not self.cache:
+            return compute()
+        version = self._known_version(habit_id)
+        value = self.memo.get((habit_id, metric, version), _MISSING)
+        if value is _MISSING:
+            version, value = self.db.get_cached_result(habit_id, metric)
+            self._versions[habit_id] = version
+            if value is None:
+                value = compute()
+                self.db.store_cached_result(habit_id, metric, version, value)
+            self.memo.put((habit_id, metric, version), value)
+        return value
+
+    def _memoized(self, habit_id, name, compute):
+        """Return a value from the in-process cache only, for data too large for the cache table."""
+        if not self.cache:
+            return compute()
+        version = self._known_version(habit_id)
+        if version is None:
+            version = self._versions[habit_id] = self.db.get_write_version(habit_id)
+        value = self.memo.get((habit_id, name, version), _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.memo.put((habit_id, name, version), value)
+        return value
+
+    def invalidate(self, habit_ids):
+        """
+        Drop the in-process cache entries of some habits and of results over all habits.
+
+        Entries are keyed by write version, so stale ones are never served; this frees
+        them at once instead of waiting for them to be evicted.
+        """
+        habit_ids = {0, *habit_ids}
+        self.memo.invalidate(habit_ids)
+        for habit_id in habit_ids:
+            self._versions.pop(habit_id, None)
+
+    def _completion_periods(self, habit_id, periodicity):
+        """A habit's completed period ordinals as a compact array, cached in process."""
+        return self._memoized(habit_id, f"periods:{periodicity}",
+                              lambda: array("i", self.db.get_completion_periods(habit_id, periodicity)))
+
+    def get_longest_streak(self, engine=None):
         """
         Calculate the longest streak across all habits.
 
+        Args:
+            engine (str, optional): Streak engine to use; see get_longest_streaks.
+
         Returns:
             int: The length of the longest streak in days or weeks, depending on the habit periodicity.
         """
-        habits = self.db.get_habits()
-        longest_streak = 0
+        engine = self._check_engine(engine)
+        if engine == "state":
+            return self.db.get_max_longest_streak()
+        return self._cached(0, f"longest_streak:{engine}",
+                            lambda: max(self._longest_streaks(engine).values(), default=0))
+
+    def get_longest_streaks(self, engine=None):
+        """
+        Calculate the longest streak of every habit.
 
-        for habit in habits:
+        Args:
+            engine (str, optional): How to compute the streaks, one of STREAK_ENGINES.
+                "state" reads the streak state maintained on every insert;
+                "python" reads each habit's completion periods and walks them in Python;
+                "array" does the same with NumPy's vectorized run detection, or like
+                "python" when NumPy is not installed;
+                "sql" answers for all habits at once with a gaps-and-islands query;
+                "bitmap" shifts and ANDs each habit's day bitmap;
+                "stream" reads every completion in one ordered query and reduces each
+                habit's rows as they go past.
+                Defaults to DEFAULT_STREAK_ENGINE.
+
+        Every engine but "state", which is a lookup already, goes through the analytics cache.
+
+        Returns:
+            dict: The longest streak of each habit, keyed by habit ID.
+        """
+        engine = self._check_engine(engine)
+        if engine == "state":
+            return dict(self.db.get_longest_streaks_from_state())
+        # Stored as pairs, since JSON object keys are strings
+        return dict(self._cached(0, f"longest_streaks:{engine}",
+                                 lambda: list(self._longest_streaks(engine).items())))
+
+    def get_longest_streaks_parallel(self, workers):
+        """
+        Calculate the longest streak of every habit with the stream engine in several processes.
+
+        The habit IDs are split into contiguous ranges. Each worker opens its own read-only
+        connection and streams one range at a time, so its memory stays at one fetch batch
+        whatever the size of the range. The per-range results are merged in ID order, so the
+        result does not depend on the number of workers.
+
+        Workers see committed data only. If any of them read another write version of the
+        habit set than this connection, which happens inside a unit of work with pending
+        writes or when another connection commits meanwhile, their results are dropped and
+        the streaks are computed on this connection instead, so the cached result always
+        matches the version it is stored under.
+
+        Args:
+            workers (int): Number of worker processes.
+
+        Returns:
+            dict: The longest streak of each habit, keyed by habit ID.
+        """
+        if workers < 1:
+            raise ValueError("The number of workers must be at least 1.")
+        if self.db.db_name == ":memory:":
+            raise ValueError("Parallel analytics need a database file.")
+
+        def compute():
+            version = self.db.get_write_version(0)
+            ranges = habit_id_ranges(self.db.get_habit_ids(), workers * PARALLEL_CHUNKS_PER_WORKER)
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_longest_streaks_in_range, repeat(self.db.db_name), ranges))
+            if any(worker_version != version for worker_version, _ in results):
+                return list(self._stream_longest_streaks().items())
+            return list(chain.from_iterable(streaks for _, streaks in results))
+
+        return dict(self._cached(0, "longest_streaks:stream", compute))
+
+    @staticmethod
+    def fleet_summary(paths, workers=None, group_size=FLEET_ATTACH_GROUP_SIZE):
+        """
+        Aggregate statistics over many habit databases, such as one per user or team.
+
+        The files are split into groups of up to group_size. Each group is read through
+        one connection that ATTACHes its files read-only and answers with a single
+        statement, using the streak state and counts every database already keeps.
+        When there is more than one group, the groups are spread over worker processes.
+        Per-database results are reduced in path order, so the result does not depend on
+        the grouping or the number of workers. The databases must be fully migrated.
+
+        Args:
+            paths (str or iterable): Database paths or glob patterns.
+            workers (int, optional): Worker processes for several groups. Defaults to
+                the number of CPUs, and 1 reads every group in this process.
+            group_size (int, optional): Database files attached to one connection.
+
+        Returns:
+            dict: "databases", "habits", "habits_by_periodicity", "completions",
+            "longest_streak" and "longest_streak_habit", a (path, habit_id, periodicity)
+            tuple or None when no habit has completions.
+        """
+        if workers is not None and workers < 1:
+            raise ValueError("The number of workers must be at least 1.")
+        if group_size < 1:
+            raise ValueError("The group size must be at least 1.")
+        paths = expand_database_paths(paths)
+        groups = [paths[start:start + group_size] for start in range(0, len(paths), group_size)]
+        workers = min(workers or os.cpu_count() or 1, len(groups))
+        if workers == 1:
+            results = map(_summarize_database_group, groups)
+            return _merge_fleet_summaries(chain.from_iterable(results))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_summarize_database_group, groups)
+            return _merge_fleet_summaries(chain.from_iterable(results))
+
+    def _longest_streaks(self, engine):
+        """Compute the longest streak of every habit with a given engine, bypassing the cache."""
+        if engine == "sql":
+            return dict(self.db.get_longest_streaks())
+        if engine == "bitmap":
+            return {habit_id: bitmap.longest_run(periodicity)
+                    for habit_id, (periodicity, bitmap) in self.db.get_day_bitmaps().items()}
+        if engine == "stream":
+            return self._stream_longest_streaks()
+
+        longest_run = longest_run_vectorized if engine == "array" and numpy is not None else self._longest_run
+        longest_streaks = {}
+        for habit in self.db.get_habits():
             habit_id = habit[0]
             periodicity = habit[2]  # Get the periodicity of the habit
-            completion_dates = self.db.get_completion_dates(habit_id)
-            streak = self._calculate_streak(completion_dates, periodicity)
-            longest_streak = max(longest_streak, streak)
-
-        return longest_streak
+            periods = self._completion_periods(habit_id, periodicity)
+            longest_streaks[habit_id] = longest_run(periods)
+        return longest_streaks
 
-    def get_longest_streak_for_habit(self, habit_id):
+    def get_longest_streak_for_habit(self, habit_id, engine=None):
         """
         Calculate the longest streak for a specific habit.
 
         Args:
             habit_id (int): The ID of the habit.
+            engine (str, optional): Streak engine to use; see get_longest_streaks.
 
         Returns:
             int: The length of the longest streak in days or weeks, depending on the habit periodicity.
         """
+        engine = self._check_engine(engine)
+        if engine == "state":
+            state = self.db.get_streak_state(habit_id)
+            return state[2] if state else 0
+        return self._cached(habit_id, f"longest_streak:{engine}",
+                            lambda: self._longest_streak_for_habit(habit_id, engine))
+
+    def _longest_streak_for_habit(self, habit_id, engine):
+        """Compute the longest streak of one habit with a given engine, bypassing the cache."""
+        if engine == "sql":
+            rows = self.db.get_longest_streaks(habit_id)
+            return rows[0][1] if rows else 0
+        if engine == "stream":
+            return self._stream_longest_streaks(habit_id).get(habit_id, 0)
+        if engine == "bitmap":
+            bitmaps = self.db.get_day_bitmaps([habit_id])
+            if habit_id not in bitmaps:
+                return 0
+            periodicity, bitmap = bitmaps[habit_id]
+            return bitmap.longest_run(periodicity)
+
         habit = self.db.get_habit_by_id(habit_id)  # Get the habit by its ID
         if habit:
             periodicity = habit[2]  # Get the periodicity of the habit
-            completion_dates = self.db.get_completion_dates(habit_id)
-            return self._calculate_streak(completion_dates, periodicity)
+            periods = self._completion_periods(habit_id, periodicity)
+            if engine == "array" and numpy is not None:
+                return longest_run_vectorized(periods)
+            return self._longest_run(periods)
         else:
             return 0  # If the habit does not exist
 
+    def get_current_streak(self, habit_id, as_of=None):
+        """
+        Calculate the streak a habit still has going.
 
-    def _calculate_streak(self, dates, periodicity):
+        A streak stays alive until a whole period passes without a completion, so a habit
+        completed yesterday (or last week) but not yet today (or this week) keeps its streak.
+        It is read from the streak state; only a day before the latest completion needs
+        the habit's day bitmap.
+
+        Args:
+            habit_id (int): The ID of the habit.
+            as_of (date, optional): The day to evaluate. Defaults to today.
+
+        Returns:
+            int: The current streak in days or weeks, 0 if it is broken or the habit does not exist.
+        """
+        habit = self.db.get_habit_by_id(habit_id)
+        state = self.db.get_streak_state(habit_id)
+        if not habit or not state:
+            return 0
+        day = (as_of or date.today()).toordinal()
+        period = week_ordinal(day) if habit[2] == "weekly" else day
+        last_period, current_run = state[0], state[1]
+        if period >= last_period:
+            return current_run if period - last_period <= 1 else 0
+        periodicity, bitmap = self.db.get_day_bitmaps([habit_id])[habit_id]
+        return bitmap.current_run(period, periodicity)
+
+    def get_streak_segments(self, habit_id, start=None, end=None, min_length=None):
+        """
+        List every streak of a habit, oldest first, from its run-length encoded segments.
+
+        Args:
+            habit_id (int): The ID of the habit.
+            start (date, optional): Only streaks that reach this day or later.
+            end (date, optional): Only streaks that begin on or before this day.
+            min_length (int, optional): Only streaks at least this many days (or weeks) long.
+
+        Returns:
+            list: (first day, last day, length) tuples. For weekly habits the days are the
+            Monday of the first week and the Sunday of the last week, and the length is in weeks.
+        """
+        habit = self.db.get_habit_by_id(habit_id)
+        if not habit:
+            return []
+        weekly = habit[2] == "weekly"
+        to_period = (lambda day: week_ordinal(day.toordinal())) if weekly else (lambda day: day.toordinal())
+        segments = self.db.get_streak_segments(
+            habit_id, start and to_period(start), end and to_period(end), min_length)
+        if weekly:
+            return [(date.fromordinal(first * 7 + 1), date.fromordinal(last * 7 + 7), length)
+                    for first, last, length in segments]
+        return [(date.fromordinal(first), date.fromordinal(last), length) for first, last, length in segments]
+
+    def get_longest_streak_between(self, habit_id, start, end):
+        """
+        Calculate the longest streak of a habit counting only the days (or weeks) between two dates.
+
+        Args:
+            habit_id (int): The ID of the habit.
+            start (date): First day of the range.
+            end (date): Last day of the range.
+
+        Returns:
+            int: The longest streak within the range, with streaks crossing its edges cut at them.
+        """
+        habit = self.db.get_habit_by_id(habit_id)
+        if not habit:
+            return 0
+        first, last = start.toordinal(), end.toordinal()
+        if habit[2] == "weekly":
+            first, last = week_ordinal(first), week_ordinal(last)
+        segments = self.db.get_streak_segments(habit_id, first, last)
+        return max((min(end_period, last) - max(start_period, first) + 1 for start_period, end_period, _ in segments),
+                   default=0)
+
+    def get_streak_as_of(self, habit_id, day):
+        """
+        Calculate the streak a habit had going on a past day, from its streak segments.
+
+        Like get_current_streak, a streak that ended the period before still counts.
+
+        Args:
+            habit_id (int): The ID of the habit.
+            day (date): The day to look at.
+
+        Returns:
+            int: The streak length on that day, in days or weeks.
+        """
+        habit = self.db.get_habit_by_id(habit_id)
+        if not habit:
+            return 0
+        period = week_ordinal(day.toordinal()) if habit[2] == "weekly" else day.toordinal()
+        segment = self.db.get_streak_segment_at(habit_id, period)
+        if not segment:
+            return 0
+        return min(segment[1], period) - segment[0] + 1
+
+    def get_completion_counts(self, period="week", start=None, end=None, habit_id=None):
+        """
+        Count completions per habit and day, week or month, from the rollup tables.
+
+        Args:
+            period (str, optional): "day", "week" or "month". Defaults to "week".
+            start (date, optional): Only periods that end on or after this day.
+            end (date, optional): Only periods that begin on or before this day.
+            habit_id (int, optional): Only count this habit.
+
+        Returns:
+            dict: habit_id -> list of (first day of the period, completions), oldest first.
+            Periods without completions are left out.
+        """
+        to_ordinal = {"day": lambda day: day, "week": week_ordinal, "month": month_ordinal}.get(period)
+        if to_ordinal is None:
+            raise ValueError(f"Unknown period '{period}'. Choose from: day, week, month.")
+        rows = self.db.get_completion_counts(period, habit_id, start and to_ordinal(start.toordinal()),
+                                             end and to_ordinal(end.toordinal()))
+        counts = {}
+        for habit, ordinal, completions in rows:
+            if period == "week":
+                first_day = date.fromordinal(ordinal * 7 + 1)
+            elif period == "month":
+                first_day = date(ordinal // 12, ordinal % 12 + 1, 1)
+            else:
+                first_day = date.fromordinal(ordinal)
+            counts.setdefault(habit, []).append((first_day, completions))
+        return counts
+
+    def get_completion_timeline(self, habit_id):
+        """Load a habit's completions into a CompletionTimeline for repeated window queries."""
+        return self._memoized(habit_id, "timeline", lambda: CompletionTimeline.from_db(self.db, habit_id))
 
-        if not dates:
+    def get_due_habits(self, at_risk_only=False, as_of=None):
+        """
+        List the habits that have not been completed yet in the current day or week.
+
+        Args:
+            at_risk_only (bool, optional): Only list habits whose streak breaks if they are
+                not completed in this period.
+            as_of (date, optional): The day to evaluate. Defaults to today.
+
+        Returns:
+            list: (habit_id, name, periodicity, current_streak, last_completion) tuples.
+        """
+        return self.db.get_due_habits((as_of or date.today()).toordinal(), at_risk_only)
+
+    def count_completed_days(self, habit_id, start=None, end=None):
+        """
+        Count the distinct days on which a habit was completed, with a popcount over its bitmap.
+
+        Args:
+            habit_id (int): The ID of the habit.
+            start (date, optional): First day to count. Defaults to the first completion.
+            end (date, optional): Last day to count. Defaults to the last completion.
+
+        Returns:
+            int: The number of days with at least one completion.
+        """
+        bitmaps = self.db.get_day_bitmaps([habit_id])
+        if habit_id not in bitmaps:
             return 0
-    # Convert dates to just year, month and day
-        dates = [datetime.strptime(date[0], "%Y-%m-%d %H:%M:%S").date() for date in dates]
-    
-    # Sort dates in ascending order
-        dates.sort()
-         # print(f"Ordered completion dates: {dates}")
-    
-        max_streak = 1
-        current_streak = 1
-    
-    # Scroll through the dates and compare if they are consecutive
-        if periodicity == "daily":
-            for i in range(1, len(dates)):
-                date_diff = dates[i] - dates[i - 1]
-
-                 # print(f"Comparing {dates[i-1]} → {dates[i]} | Difference: {date_diff.days} days")
-        
-        # If the difference is one day, continue the streak
-                if date_diff == timedelta(days=1):
-                    current_streak += 1
-                    #print(f"Continuing streak: {current_streak}")
-                else:
-            # If there is a gap, restart the streak.
-                    max_streak = max(max_streak, current_streak)
-                     # print(f"Streak broken! Max so far: {max_streak}")
-                    current_streak = 1
-            max_streak = max(max_streak, current_streak)
-
-        elif periodicity == "weekly":
-        # Get unique weeks in format (year, week)
-            weeks_with_completion = {(date.isocalendar()[0], date.isocalendar()[1]) for date in dates}
-            
-
-        # Order the weeks
-            sorted_weeks = sorted(weeks_with_completion)
-            
-
-            last_year, last_week = None, None
-            for year, week in sorted_weeks:
-                 # print(f"Checking week: {year}-W{week}")
-                if last_year is None:  # First week registered
-                    current_streak = 1
-                elif (year == last_year and week == last_week + 1) or (year > last_year and last_week == 52 and week == 1):
-                    current_streak += 1  # Week in a row, add to the streak
-                else:
-                    max_streak = max(max_streak, current_streak)
-                    current_streak = 1  # There was an empty week, restarting the streak
-
-                last_year, last_week = year, week  # Update last registered week
-                
-
-            max_streak = max(max_streak, current_streak)
-             # print(f"Final max streak: {max_streak}")
-        
-        return max_streak
+        return bitmaps[habit_id][1].count(start and start.toordinal(), end and end.toordinal())
+
+    def get_completion_rate(self, habit_id, start, end=None):
+        """
+        Calculate the share of days between two dates (inclusive) on which a habit was completed.
+
+        Args:
+            habit_id (int): The ID of the habit.
+            start (date): First day of the range.
+            end (date, optional): Last day of the range. Defaults to today.
+
+        Returns:
+            float: A value between 0 and 1.
+        """
+        end = end or date.today()
+        if end < start:
+            raise ValueError("The end date must not be before the start date.")
+        return self.count_completed_days(habit_id, start, end) / ((end - start).days + 1)
+
+    def get_days_completed_together(self, habit_ids):
+        """
+        Find the days on which every one of the given habits was completed, by ANDing their bitmaps.
+
+        Args:
+            habit_ids (iterable): IDs of the habits to compare.
+
+        Returns:
+            list: The shared completion days as date objects, oldest first. Empty if any habit does not exist.
+        """
+        habit_ids = set(habit_ids)
+        bitmaps = self.db.get_day_bitmaps(habit_ids)
+        if not habit_ids or len(bitmaps) < len(habit_ids):
+            return []
+        bitmaps = [bitmap for _, bitmap in bitmaps.values()]
+        common = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            common = common & bitmap
+        return common.dates()
+
+    def get_habit_stats(self, metrics=None, habit_id=None, as_of=None, id_range=None):
+        """
+        Compute several metrics for every habit (or one habit) in one pass over the completions.
+
+        Args:
+            metrics (iterable, optional): Names from METRICS. Defaults to all of them.
+            habit_id (int, optional): Only compute the metrics of this habit.
+            as_of (date, optional): Compute the metrics as they stood at the end of this
+                day, ignoring later completions. Defaults to today, with every completion.
+            id_range (tuple, optional): (first, last) habit IDs to compute, inclusive.
+
+        Returns:
+            dict: habit_id -> {metric name: value}, in the order the metrics were requested.
+        """
+        names = list(metrics) if metrics is not None else list(METRICS)
+        unknown = [name for name in names if name not in METRICS]
+        if unknown:
+            raise ValueError(f"Unknown metric '{unknown[0]}'. Choose from: {', '.join(METRICS)}.")
+        today = (as_of or date.today()).toordinal()
+        last_day = as_of.toordinal() if as_of is not None else None
+
+        stats = {}
+        for habit, rows in groupby(self.db.iter_completions(habit_id, id_range=id_range), key=itemgetter(0)):
+            reducers = None
+            for _, periodicity, day, _ in rows:
+                if reducers is None:
+                    reducers = [METRICS[name](periodicity, today) for name in names]
+                if day is not None and (last_day is None or day <= last_day):
+                    for reducer in reducers:
+                        reducer.update(day)
+            stats[habit] = {name: reducer.result() for name, reducer in zip(names, reducers)}
+        return stats
+
+    def _stream_longest_streaks(self, habit_id=None, id_range=None):
+        """Longest streak per habit from a single pass over iter_completions."""
+        return {habit: metrics["longest_streak"]
+                for habit, metrics in self.get_habit_stats(["longest_streak"], habit_id, id_range=id_range).items()}
+
+    @staticmethod
+    def _check_engine(engine):
+        """Return the engine to use, rejecting unknown names."""
+        engine = engine or DEFAULT_STREAK_ENGINE
+        if engine not in STREAK_ENGINES:
+            raise ValueError(f"Unknown streak engine '{engine}'. Choose from: {', '.join(STREAK_ENGINES)}.")
+        return engine
+
+    @staticmethod
+    def _longest_run(periods):
+        """
+        Find the longest run of consecutive periods.
+
+        Args:
+            periods (iterable of int): Day or ISO-week ordinals in ascending order, repeats allowed.
+
+        Returns:
+            int: The length of the longest run of consecutive ordinals.
+        """
+        longest_run = current_run = 0
+        previous = None
+        for period in periods:
+            if period == previous:
+                continue  # Completed more than once in the same period
+            if previous is not None and period == previous + 1:
+                current_run += 1
+            else:
+                current_run = 1
+            longest_run = max(longest_run, current_run)
+            previous = period
+        return longest_run
+
+    def _calculate_streak(self, dates, periodicity):
+        """
+        Calculate the longest streak from a list of completion timestamps.
+
+        Each timestamp becomes a day ordinal, or an ISO-week ordinal for weekly habits,
+        so both periodicities reduce to finding the longest run of consecutive integers.
+        Week ordinals are consecutive across ISO years with 52 or 53 weeks.
+
+        Args:
+            dates (list): ("YYYY-MM-DD HH:MM:SS",) rows, in any order.
+            periodicity (str): "daily" or "weekly".
+
+        Returns:
+            int: The length of the longest streak in days or weeks.
+        """
+        days = [parse_day_ordinal(date[0]) for date in dates]
+        if periodicity == "weekly":
+            periods = {week_ordinal(day) for day in days}
+        elif periodicity == "daily":
+            periods = set(days)
+        else:
+            return 1 if days else 0
+        return self._longest_run(sorted(periods))
 
     def close(self):
         """
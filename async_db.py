@@ -0,0 +1,170 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from queue import SimpleQueue
+from db_manager import HabitDatabase
+
+# Reader threads of an AsyncHabitDatabase, each with a connection of its own.
+DEFAULT_READERS = 4
+
+# HabitDatabase methods run on the reader threads, over read-only connections.
+READ_METHODS = (
+    "get_schema_version", "get_settings", "get_pending_migrations", "get_change_token",
+    "get_write_version", "get_analytics_cache_size", "get_cached_result",
+    "get_habit_by_id", "get_habits", "has_habits", "get_habit_ids", "get_habits_by_periodicity",
+    "get_completion_dates", "get_completions_between", "count_completions_between",
+    "get_completion_epochs", "get_completion_periods", "get_completion_counts",
+    "get_longest_streaks", "get_streak_state", "get_streak_segments", "get_streak_segment_at",
+    "get_due_habits", "get_longest_streaks_from_state", "get_max_longest_streak", "get_day_bitmaps",
+)
+
+# HabitDatabase methods run on the single writer thread, one at a time.
+WRITE_METHODS = (
+    "migrate", "insert_habit", "store_cached_result", "clear_analytics_cache", "delete_habit",
+    "mark_habit_completed", "insert_completion_datetime", "insert_completions_bulk",
+    "rebuild_rollups", "delete_all_habits", "replace_all_habits",
+)
+
+
+def _serve(jobs, open_db, ready):
+    """
+    Thread body: open a connection, then run jobs from a queue on it until a None arrives.
+
+    Each job is (future, func, args, kwargs) and is called as func(db, *args, **kwargs).
+    The connection is created, used and closed on this thread only.
+    """
+    try:
+        db = open_db()
+    except BaseException as e:
+        ready.set_exception(e)
+        return
+    ready.set_result(None)
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            future, func, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue  # The awaiting coroutine was cancelled before the job started
+            try:
+                future.set_result(func(db, *args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+    finally:
+        db.close()
+
+
+def _delegate(name, writes):
+    """Build the coroutine method of AsyncHabitDatabase that runs HabitDatabase.<name> on a worker thread."""
+    async def method(self, *args, **kwargs):
+        return await self._submit(self._write_jobs if writes else self._read_jobs,
+                                  getattr(HabitDatabase, name), args, kwargs)
+    method.__name__ = name
+    method.__qualname__ = f"AsyncHabitDatabase.{name}"
+    method.__doc__ = getattr(HabitDatabase, name).__doc__
+    return method
+
+
+class AsyncHabitDatabase:
+    """
+    An asyncio facade over HabitDatabase for callers such as API servers and schedulers.
+
+    SQLite connections belong to the thread that made them, so every call is handed
+    to a dedicated thread holding its own connection: reads to a small pool of reader
+    threads with read-only connections, which run concurrently, and writes to a single
+    writer thread, which runs them one after another. Awaiting a call never blocks the
+    event loop. The methods listed in READ_METHODS and WRITE_METHODS take the same
+    arguments as on HabitDatabase and return the same values.
+
+    Readers see committed data only. With the rollback journal of the default profile,
+    a reader waits while a write commits; the "balanced" and "throughput" profiles use WAL,
+    where readers and the writer do not block each other.
+    """
+
+    def __init__(self, db_name="habits.db", readers=DEFAULT_READERS, profile=None):
+        """
+        Open the writer connection, applying pending migrations, then the reader connections.
+
+        Args:
+            db_name (str, optional): Database file path. Defaults to "habits.db".
+            readers (int, optional): Number of reader threads. Defaults to DEFAULT_READERS.
+            profile (str, optional): Performance profile; see db_manager.resolve_profile.
+        """
+        if db_name == ":memory:":
+            raise ValueError("AsyncHabitDatabase needs a database file; every thread opens its own connection.")
+        if readers < 1:
+            raise ValueError("The number of readers must be at least 1.")
+        self.db_name = db_name
+        self._read_jobs = SimpleQueue()
+        self._write_jobs = SimpleQueue()
+        self._threads = []
+        self._closed = False
+        # The writer creates and migrates the schema before any reader opens the file
+        self._start("habit-db-writer", self._write_jobs, lambda: HabitDatabase(db_name, profile=profile))
+        for index in range(readers):
+            self._start(f"habit-db-reader-{index}", self._read_jobs,
+                        lambda: HabitDatabase(db_name, profile=profile, read_only=True))
+
+    def _start(self, name, jobs, open_db):
+        """Start a worker thread and wait until its connection is open, raising any error it met."""
+        ready = Future()
+        thread = threading.Thread(target=_serve, args=(jobs, open_db, ready), name=name, daemon=True)
+        thread.start()
+        try:
+            ready.result()
+        except BaseException:
+            self._stop()
+            raise
+        self._threads.append((thread, jobs))
+
+    async def _submit(self, jobs, func, args, kwargs):
+        """Queue func(db, *args, **kwargs) for a worker thread and await its result."""
+        if self._closed:
+            raise ValueError("The database is closed.")
+        future = Future()
+        jobs.put((future, func, args, kwargs))
+        return await asyncio.wrap_future(future)
+
+    async def read(self, func, *args, **kwargs):
+        """
+        Run func(db, *args, **kwargs) on a reader thread, for reads that take several calls.
+
+        For example, analytics over a reader's connection, which is read-only and so
+        must not store results in the analytics cache:
+            await adb.read(lambda db: Analytics(db, cache=False).get_longest_streaks("sql"))
+        """
+        return await self._submit(self._read_jobs, func, args, kwargs)
+
+    async def write(self, func, *args, **kwargs):
+        """Run func(db, *args, **kwargs) on the writer thread as one unit of work, and return its result."""
+        def in_transaction(db, *args, **kwargs):
+            with db.transaction():
+                return func(db, *args, **kwargs)
+        return await self._submit(self._write_jobs, in_transaction, args, kwargs)
+
+    def _stop(self):
+        """Tell every started thread to close its connection once its queued jobs are done."""
+        self._closed = True
+        for _, jobs in self._threads:
+            jobs.put(None)
+
+    async def close(self):
+        """Finish the queued calls, then close every connection."""
+        if not self._closed:
+            self._stop()
+        for thread, _ in self._threads:
+            await asyncio.to_thread(thread.join)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+for _name in READ_METHODS:
+    setattr(AsyncHabitDatabase, _name, _delegate(_name, writes=False))
+for _name in WRITE_METHODS:
+    setattr(AsyncHabitDatabase, _name, _delegate(_name, writes=True))
+del _name
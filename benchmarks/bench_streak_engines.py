@@ -0,0 +1,54 @@
+"""
+Compare the run detection of the python and array streak engines on a single habit with many completions.
+
+Both engines get the same input, the ascending day ordinals that
+HabitDatabase.get_completion_periods returns, so only the run detection is measured.
+Peak memory is the largest amount traced by tracemalloc while the engine runs.
+
+Run from the repository root:
+    python benchmarks/bench_streak_engines.py [completions]
+"""
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import Analytics, longest_run_vectorized  # noqa: E402
+
+
+def measure(label, func, periods, repeats=3):
+    """Print the best wall time of func(periods) and its peak traced memory."""
+    elapsed = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func(periods)
+        elapsed.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func(periods)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<40} {min(elapsed):8.3f}s {peak / 2**20:8.2f} MiB peak  longest run {result}")
+    return min(elapsed)
+
+
+def main(completions=1_000_000):
+    rng = random.Random(1)
+    start = datetime(1990, 1, 1).toordinal()
+    # About 40 completions a day, with a gap now and then
+    periods = sorted(start + rng.randint(0, completions // 40) for _ in range(completions))
+
+    print(f"{completions:,} completions")
+    loop = measure("python engine (Analytics._longest_run)", Analytics._longest_run, periods)
+    if longest_run_vectorized is None:
+        print("NumPy is not installed, so the array engine runs the same loop as the python engine.")
+        return
+    vectorized = measure("array engine (NumPy)", longest_run_vectorized, periods)
+    print(f"array engine speed-up: {loop / vectorized:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,45 @@
+"""
+Compare datetime.strptime with the timestamps codec on many "YYYY-MM-DD HH:MM:SS" strings.
+
+Run from the repository root:
+    python benchmarks/bench_timestamp_codec.py [timestamps]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timestamps import TIMESTAMP_FORMAT, encode_completion, parse_day_ordinal, parse_timestamp  # noqa: E402
+
+
+def measure(label, func, texts):
+    """Apply func to every string once and print the wall time and the cost per row."""
+    start = time.perf_counter()
+    for text in texts:
+        func(text)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<45} {elapsed:8.3f}s {elapsed / len(texts) * 1e9:8.0f} ns/row")
+    return elapsed
+
+
+def main(count=1_000_000):
+    rng = random.Random(1)
+    start = datetime(2000, 1, 1)
+    texts = [(start + timedelta(seconds=rng.randint(0, 25 * 365 * 86400))).strftime(TIMESTAMP_FORMAT)
+             for _ in range(count)]
+
+    print(f"{count:,} timestamps")
+    baseline = measure("datetime.strptime", lambda text: datetime.strptime(text, TIMESTAMP_FORMAT), texts)
+    fast = measure("parse_timestamp", parse_timestamp, texts)
+    measure("datetime.strptime(...).toordinal()",
+            lambda text: datetime.strptime(text, TIMESTAMP_FORMAT).toordinal(), texts)
+    measure("parse_day_ordinal", parse_day_ordinal, texts)
+    measure("encode_completion (epoch, day, week)", encode_completion, texts)
+    print(f"parse_timestamp speed-up: {baseline / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
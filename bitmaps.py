@@ -0,0 +1,133 @@
+from datetime import date
+
+
+def monday_on_or_before(day_ordinal):
+    """Return the ordinal of the Monday starting the ISO week of a day ordinal."""
+    return day_ordinal - (day_ordinal - 1) % 7
+
+
+def _longest_run_of_ones(bits):
+    """Length of the longest run of set bits: each x & (x >> 1) shortens every run by one."""
+    length = 0
+    while bits:
+        bits &= bits >> 1
+        length += 1
+    return length
+
+
+def _run_of_ones_ending_at(bits, index):
+    """Length of the run of set bits ending at bit `index` (0 if that bit is clear)."""
+    if index < 0:
+        return 0
+    zeros = ~bits & ((1 << (index + 1)) - 1)
+    return index + 1 if not zeros else index - (zeros.bit_length() - 1)
+
+
+class DayBitmap:
+    """
+    The set of days on which a habit was completed, stored as one bit per day.
+
+    Bit i stands for day ordinal origin + i, with the bits packed little-endian into
+    bytes so they can be stored as a BLOB. The origin is always a Monday so that
+    the bitmap can also be folded into whole ISO weeks.
+    """
+
+    __slots__ = ("origin", "bits")
+
+    def __init__(self, origin, bits=b""):
+        """
+        Args:
+            origin (int): Day ordinal of bit 0; rounded down to a Monday.
+            bits (bytes, optional): The packed bits, as stored in the database.
+        """
+        aligned = monday_on_or_before(origin)
+        self.origin = aligned
+        self.bits = bytearray(bits)
+        if aligned != origin and bits:
+            self._replace(int(self) << (origin - aligned))
+
+    def __int__(self):
+        return int.from_bytes(self.bits, "little")
+
+    def _replace(self, value):
+        self.bits = bytearray(value.to_bytes((value.bit_length() + 7) // 8, "little"))
+
+    def add(self, day_ordinal):
+        """Mark a day as completed, growing the bitmap in either direction if needed."""
+        if day_ordinal < self.origin:
+            new_origin = monday_on_or_before(day_ordinal)
+            self._replace(int(self) << (self.origin - new_origin))
+            self.origin = new_origin
+        index = day_ordinal - self.origin
+        missing = index // 8 + 1 - len(self.bits)
+        if missing > 0:
+            self.bits.extend(bytes(missing))
+        self.bits[index // 8] |= 1 << (index % 8)
+
+    def __contains__(self, day_ordinal):
+        index = day_ordinal - self.origin
+        return 0 <= index < len(self.bits) * 8 and bool(self.bits[index // 8] >> (index % 8) & 1)
+
+    def days(self):
+        """Yield the completed day ordinals in ascending order."""
+        value = int(self)
+        while value:
+            lowest = value & -value
+            yield self.origin + lowest.bit_length() - 1
+            value ^= lowest
+
+    def count(self, start=None, end=None):
+        """Number of completed days between two day ordinals (inclusive), by popcount."""
+        value = int(self)
+        if end is not None:
+            if end < self.origin:
+                return 0
+            value &= (1 << (end - self.origin + 1)) - 1
+        if start is not None and start > self.origin:
+            value >>= start - self.origin
+        return value.bit_count()
+
+    def weeks(self):
+        """Fold the days into weeks: return (origin week ordinal, int with one bit per ISO week)."""
+        value = int(self)
+        folded = 0
+        week = 0
+        while value:
+            if value & 0x7F:
+                folded |= 1 << week
+            value >>= 7
+            week += 1
+        return (self.origin - 1) // 7, folded
+
+    def _units(self, periodicity):
+        """Return (origin ordinal, bits) in days, or in weeks for weekly habits."""
+        if periodicity == "weekly":
+            return self.weeks()
+        return self.origin, int(self)
+
+    def longest_run(self, periodicity="daily"):
+        """Longest streak of consecutive days (or weeks) in the bitmap."""
+        return _longest_run_of_ones(self._units(periodicity)[1])
+
+    def current_run(self, period, periodicity="daily"):
+        """
+        Streak still alive in a given period (a day ordinal, or an ISO-week ordinal for weekly habits).
+
+        This is the run ending in that period, or in the previous one when the habit has not
+        been completed yet in the current period. 0 means the streak is already broken.
+        """
+        origin, bits = self._units(periodicity)
+        return (_run_of_ones_ending_at(bits, period - origin)
+                or _run_of_ones_ending_at(bits, period - 1 - origin))
+
+    def __and__(self, other):
+        """Days completed in both bitmaps."""
+        origin = max(self.origin, other.origin)
+        common = (int(self) >> (origin - self.origin)) & (int(other) >> (origin - other.origin))
+        result = DayBitmap(origin)
+        result._replace(common)
+        return result
+
+    def dates(self):
+        """Return the completed days as date objects."""
+        return [date.fromordinal(day) for day in self.days()]
@@ -1,15 +1,561 @@
+import json
+import os
 import sqlite3
-from datetime import datetime
+import time
+from urllib.request import pathname2url
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, datetime
+from itertools import islice
+
+from bitmaps import DayBitmap
+from timestamps import encode_completion, month_ordinal, week_ordinal
+
+# Rows moved per fetchmany/executemany round when a migration copies data.
+MIGRATION_BATCH_SIZE = 10000
+
+# Completions written per executemany and per commit by insert_completions_bulk.
+BULK_CHUNK_SIZE = 5000
+
+# Rows fetched per fetchmany round when completions are streamed.
+STREAM_BATCH_SIZE = 10000
+
+
+# Habits whose rollups are recomputed per transaction by rebuild_rollups.
+ROLLUP_BATCH_SIZE = 500
+
+# Completion count rollups: period name -> (table, SQL expression of the period ordinal
+# over completion_dates). Month ordinals are year * 12 + month - 1.
+ROLLUPS = {
+    "day": ("completion_rollups_day", "day_ordinal"),
+    "week": ("completion_rollups_week", "week_ordinal"),
+    "month": ("completion_rollups_month",
+              "CAST(strftime('%Y', completion_epoch, 'unixepoch') AS INTEGER) * 12"
+              " + CAST(strftime('%m', completion_epoch, 'unixepoch') AS INTEGER) - 1"),
+}
+
+
+# Named sets of PRAGMAs applied to every new connection. "durable" is SQLite's own
+# default behaviour; "balanced" and "throughput" use WAL so that readers are not
+# blocked by a writer, and trade some durability on power loss for fewer fsyncs.
+# journal_mode is stored in the file and switching it needs exclusive access, so
+# "durable" keeps whatever mode the file has and no profile ever leaves WAL.
+PERFORMANCE_PROFILES = {
+    "durable": {
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+    "throughput": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+    },
+}
+
+DEFAULT_PROFILE = "durable"
+
+# PRAGMAs a profile or the config file may set, in the order get_settings reports them.
+PROFILE_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store")
+
+# The profile can be chosen with this environment variable, or with a config file
+# such as {"profile": "balanced", "pragmas": {"cache_size": -32000}}.
+PROFILE_ENV_VAR = "HABIT_TRACKER_PROFILE"
+CONFIG_FILE = "habit_tracker.json"
+
+
+def resolve_profile(profile=None, config_path=CONFIG_FILE):
+    """
+    Work out which performance profile to use and the PRAGMAs it sets.
+
+    The profile is taken from the argument, then the HABIT_TRACKER_PROFILE environment
+    variable, then the "profile" key of the config file, then DEFAULT_PROFILE. PRAGMAs
+    listed under "pragmas" in the config file override the profile's values.
+
+    Returns:
+        tuple: (profile name, dict of PRAGMA name to value).
+
+    Raises:
+        ValueError: If the profile or a configured PRAGMA is unknown.
+    """
+    config = {}
+    if config_path and os.path.exists(config_path):
+        with open(config_path, "r") as f:
+            config = json.load(f)
+
+    name = profile or os.environ.get(PROFILE_ENV_VAR) or config.get("profile") or DEFAULT_PROFILE
+    if name not in PERFORMANCE_PROFILES:
+        raise ValueError(f"Unknown performance profile '{name}'. Choose from: {', '.join(PERFORMANCE_PROFILES)}.")
+
+    pragmas = dict(PERFORMANCE_PROFILES[name])
+    for pragma, value in config.get("pragmas", {}).items():
+        if pragma not in PROFILE_PRAGMAS:
+            raise ValueError(f"Unsupported PRAGMA '{pragma}' in {config_path}.")
+        if not isinstance(value, int) and not str(value).isalnum():
+            raise ValueError(f"Invalid value {value!r} for PRAGMA '{pragma}' in {config_path}.")
+        if pragma == "journal_mode" and str(value).upper() != "WAL":
+            raise ValueError(f"journal_mode can only be set to WAL, in {config_path}.")
+        pragmas[pragma] = value
+    return name, pragmas
+
+
+def read_only_uri(db_name):
+    """Return a URI that opens an existing database file read-only (for sqlite3.connect(..., uri=True) or ATTACH)."""
+    return f"file:{pathname2url(os.path.abspath(db_name))}?mode=ro"
+
+
+def chunked(iterable, size):
+    """Yield lists of up to `size` items from any iterable, without materializing it."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def copy_in_batches(conn, select_sql, insert_sql, transform=None, batch_size=MIGRATION_BATCH_SIZE):
+    """
+    Copy the rows of a SELECT into an INSERT statement batch by batch.
+
+    Only one batch is held in memory at a time, so large tables can be rewritten
+    by a migration without loading them completely.
+
+    Args:
+        conn (sqlite3.Connection): The connection the migration runs on.
+        select_sql (str): Query producing the source rows.
+        insert_sql (str): Parameterized statement receiving each row.
+        transform (callable, optional): Function applied to every row before it is inserted.
+        batch_size (int, optional): Number of rows per batch.
+
+    Returns:
+        int: The number of rows copied.
+    """
+    cursor = conn.execute(select_sql)
+    copied = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        if transform:
+            rows = [transform(row) for row in rows]
+        conn.executemany(insert_sql, rows)
+        copied += len(rows)
+    return copied
+
+
+def _add_completion_index(conn):
+    # Covering index: streak queries read a habit's completions
+    # in order straight from the index, without touching the table.
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS idx_completion_dates_habit_datetime
+    ON completion_dates (habit_id, completion_datetime)
+    """)
+
+
+def _store_completions_as_integers(conn):
+    # Rebuild completion_dates with integer columns, parsing the old TEXT values batch by batch.
+    conn.execute("""
+    CREATE TABLE completion_dates_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        habit_id INTEGER NOT NULL,
+        completion_epoch INTEGER NOT NULL,
+        day_ordinal INTEGER NOT NULL,
+        week_ordinal INTEGER NOT NULL,
+        FOREIGN KEY (habit_id) REFERENCES habits(id)
+    )
+    """)
+    copy_in_batches(
+        conn,
+        "SELECT id, habit_id, completion_datetime FROM completion_dates",
+        "INSERT INTO completion_dates_new VALUES (?, ?, ?, ?, ?)",
+        transform=lambda row: (row[0], row[1], *encode_completion(datetime.fromisoformat(row[2]))),
+    )
+    conn.execute("DROP TABLE completion_dates")
+    conn.execute("ALTER TABLE completion_dates_new RENAME TO completion_dates")
+    # Covers every analytics read, so the table itself is only used for inserts.
+    conn.execute("""
+    CREATE INDEX idx_completion_dates_habit_epoch
+    ON completion_dates (habit_id, completion_epoch, day_ordinal, week_ordinal)
+    """)
+
+
+def _add_unique_habit_name_index(conn):
+    # Older databases may hold names that only differ by case; keep the first one
+    # and suffix the others with their ID so the unique index can be built. A suffixed
+    # name can itself be taken already, so a counter is added until it is free.
+    duplicates = conn.execute("""
+    SELECT id, name FROM habits AS h
+    WHERE EXISTS (SELECT 1 FROM habits AS o WHERE o.name = h.name COLLATE NOCASE AND o.id < h.id)
+    ORDER BY id
+    """).fetchall()
+    for habit_id, name in duplicates:
+        new_name, counter = f"{name} ({habit_id})", 1
+        while conn.execute("SELECT 1 FROM habits WHERE name = ? COLLATE NOCASE", (new_name,)).fetchone():
+            counter += 1
+            new_name = f"{name} ({habit_id}-{counter})"
+        conn.execute("UPDATE habits SET name = ? WHERE id = ?", (new_name, habit_id))
+    conn.execute("CREATE UNIQUE INDEX idx_habits_name_nocase ON habits (name COLLATE NOCASE)")
+
+
+def _streak_runs_cte(habit_filter=""):
+    """
+    Return a WITH clause defining runs(habit_id, end_period, run_length), one row per streak.
+
+    Uses the gaps-and-islands technique: within a habit, distinct period ordinals minus
+    their ROW_NUMBER() are constant along a run of consecutive periods, so each run is
+    one group and its size is the streak length. `habit_filter` is an optional WHERE
+    clause on the habits table (aliased h).
+    """
+    return f"""
+    WITH periods AS (
+        SELECT DISTINCT c.habit_id,
+               CASE h.periodicity WHEN 'weekly' THEN c.week_ordinal ELSE c.day_ordinal END AS period
+        FROM habits AS h JOIN completion_dates AS c ON c.habit_id = h.id
+        {habit_filter}
+    ),
+    islands AS (
+        SELECT habit_id, period, period - ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY period) AS island
+        FROM periods
+    ),
+    runs AS (
+        SELECT habit_id, MAX(period) AS end_period, COUNT(*) AS run_length
+        FROM islands GROUP BY habit_id, island
+    )
+    """
+
+
+def _habit_id_filter(habit_ids, column):
+    """Return (SQL condition, parameters) restricting a column to some habit IDs, or ("", []) for all habits."""
+    if habit_ids is None:
+        return "", []
+    habit_ids = list(habit_ids)
+    return f"WHERE {column} IN ({', '.join('?' * len(habit_ids))})", habit_ids
+
+
+def _rebuild_streak_state(conn, habit_ids=None):
+    """Recompute habit_streak_state from the completion history, for some habits or all of them, in one statement."""
+    condition, params = _habit_id_filter(habit_ids, "habit_id")
+    conn.execute(f"DELETE FROM habit_streak_state {condition}", params)
+    conn.execute(_streak_runs_cte(_habit_id_filter(habit_ids, "h.id")[0]) + """
+    , ranked AS (
+        SELECT habit_id, end_period, run_length,
+               MAX(run_length) OVER (PARTITION BY habit_id) AS longest_run,
+               ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY end_period DESC) AS recency
+        FROM runs
+    )
+    INSERT INTO habit_streak_state (habit_id, last_period, current_run, longest_run, last_completion)
+    SELECT habit_id, end_period, run_length, longest_run,
+           (SELECT MAX(completion_epoch) FROM completion_dates AS c WHERE c.habit_id = ranked.habit_id)
+    FROM ranked WHERE recency = 1
+    """, params)
+
+
+def _add_streak_state(conn):
+    # One row per habit with completions: the latest period completed, the length of
+    # the run ending there and the longest run so far, kept up to date on every insert.
+    conn.execute("""
+    CREATE TABLE habit_streak_state (
+        habit_id INTEGER PRIMARY KEY,
+        last_period INTEGER NOT NULL,
+        current_run INTEGER NOT NULL,
+        longest_run INTEGER NOT NULL,
+        FOREIGN KEY (habit_id) REFERENCES habits(id)
+    )
+    """)
+    # The backfill as shipped with version 4; _rebuild_streak_state fills later columns too
+    conn.execute(_streak_runs_cte() + """
+    , ranked AS (
+        SELECT habit_id, end_period, run_length,
+               MAX(run_length) OVER (PARTITION BY habit_id) AS longest_run,
+               ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY end_period DESC) AS recency
+        FROM runs
+    )
+    INSERT INTO habit_streak_state (habit_id, last_period, current_run, longest_run)
+    SELECT habit_id, end_period, run_length, longest_run FROM ranked WHERE recency = 1
+    """)
+
+
+def _add_last_completion(conn):
+    # The epoch of the latest completion, and an index so that the habits whose last
+    # period is a given one (due today, at risk) are found without reading history
+    conn.execute("ALTER TABLE habit_streak_state ADD COLUMN last_completion INTEGER")
+    conn.execute("CREATE INDEX idx_habit_streak_state_last_period ON habit_streak_state (last_period)")
+    _rebuild_streak_state(conn)
+
+
+def _creation_ordinal(creation_date):
+    """Day ordinal of a habit's "YYYY-MM-DD" creation date."""
+    return date.fromisoformat(creation_date[:10]).toordinal()
+
+
+def _add_day_bitmaps(conn, batch_size=MIGRATION_BATCH_SIZE):
+    # One bit per day from the Monday of the habit's creation week (or of its first
+    # completion, if earlier); see bitmaps.DayBitmap for the layout.
+    conn.execute("""
+    CREATE TABLE habit_bitmaps (
+        habit_id INTEGER PRIMARY KEY,
+        origin_ordinal INTEGER NOT NULL,
+        bits BLOB NOT NULL,
+        FOREIGN KEY (habit_id) REFERENCES habits(id)
+    )
+    """)
+    insert_sql = "INSERT INTO habit_bitmaps (habit_id, origin_ordinal, bits) VALUES (?, ?, ?)"
+    # Completions arrive grouped by habit and oldest first, so each bitmap is built in one pass
+    cursor = conn.execute("""
+    SELECT c.habit_id, h.creation_date, c.day_ordinal
+    FROM completion_dates AS c JOIN habits AS h ON h.id = c.habit_id
+    ORDER BY c.habit_id, c.completion_epoch
+    """)
+    current_id, bitmap = None, None
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        for habit_id, creation_date, day in batch:
+            if habit_id != current_id:
+                if bitmap is not None:
+                    conn.execute(insert_sql, (current_id, bitmap.origin, bytes(bitmap.bits)))
+                current_id, bitmap = habit_id, DayBitmap(_creation_ordinal(creation_date))
+            bitmap.add(day)
+    if bitmap is not None:
+        conn.execute(insert_sql, (current_id, bitmap.origin, bytes(bitmap.bits)))
+
+
+def _rebuild_streak_segments(conn, habit_id=None):
+    """Recompute streak_segments from the completion history, for one habit or all of them."""
+    if habit_id is None:
+        conn.execute("DELETE FROM streak_segments")
+    else:
+        conn.execute("DELETE FROM streak_segments WHERE habit_id = ?", (habit_id,))
+    habit_filter = "WHERE h.id = :habit_id" if habit_id is not None else ""
+    conn.execute(_streak_runs_cte(habit_filter) + """
+    INSERT INTO streak_segments (habit_id, start_period, end_period, length)
+    SELECT habit_id, end_period - run_length + 1, end_period, run_length FROM runs
+    """, {"habit_id": habit_id})
+
+
+def _merge_streaks(conn, new_periods, states):
+    """
+    Merge back-dated periods into streak_segments and habit_streak_state.
+
+    The stored segments hold every earlier period of a habit, run-length encoded, so a
+    new period can only extend, or join, the segments that contain it or end or start
+    right next to it. Those are found with one probe of the primary key per period and
+    merged with the new periods, which gives the same runs as a rebuild from the whole
+    history. Inserts never shorten a run, so the longest run is the larger of the stored
+    one and the merged ones.
+
+    Args:
+        new_periods (dict): habit_id -> set of newly completed periods.
+        states (dict): habit_id -> stored (last_period, current_run, longest_run,
+            last_completion), with last_completion already covering the new rows.
+    """
+    probe = """
+    SELECT start_period, end_period FROM streak_segments
+    WHERE habit_id = ? AND start_period <= ? ORDER BY start_period DESC LIMIT 2
+    """
+    removed, added, new_states = [], [], []
+    for habit_id, periods in new_periods.items():
+        touched = {}
+        for period in periods:
+            # The segment starting right after the period, if any, and the one before it
+            for start, end in conn.execute(probe, (habit_id, period + 1)):
+                if end >= period - 1:
+                    touched[start] = end
+
+        intervals = sorted([*touched.items(), *((period, period) for period in periods)])
+        merged = [list(intervals[0])]
+        for start, end in intervals[1:]:
+            if start > merged[-1][1] + 1:
+                merged.append([start, end])
+            else:
+                merged[-1][1] = max(merged[-1][1], end)
+
+        last_period, current_run, longest_run, last_completion = states[habit_id]
+        last_period = max(last_period, max(periods))
+        for start, end in merged:
+            longest_run = max(longest_run, end - start + 1)
+            if start <= last_period <= end:
+                current_run = end - start + 1
+            if touched.get(start) != end:
+                added.append((habit_id, start, end, end - start + 1))
+        merged_starts = {start for start, _ in merged}
+        removed.extend((habit_id, start) for start in touched if start not in merged_starts)
+        new_states.append((habit_id, last_period, current_run, longest_run, last_completion))
+
+    conn.executemany("DELETE FROM streak_segments WHERE habit_id = ? AND start_period = ?", removed)
+    conn.executemany("""
+    INSERT OR REPLACE INTO streak_segments (habit_id, start_period, end_period, length) VALUES (?, ?, ?, ?)
+    """, added)
+    conn.executemany("""
+    INSERT OR REPLACE INTO habit_streak_state (habit_id, last_period, current_run, longest_run, last_completion)
+    VALUES (?, ?, ?, ?, ?)
+    """, new_states)
+
+
+def _add_streak_segments(conn):
+    # Every run of consecutive periods (days, or ISO weeks for weekly habits) as one
+    # row, so that streak history questions read a few segments instead of all completions
+    conn.execute("""
+    CREATE TABLE streak_segments (
+        habit_id INTEGER NOT NULL,
+        start_period INTEGER NOT NULL,
+        end_period INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        PRIMARY KEY (habit_id, start_period),
+        FOREIGN KEY (habit_id) REFERENCES habits(id)
+    )
+    """)
+    # No index on length: every query filters on habit_id, and the primary key serves it
+    _rebuild_streak_segments(conn)
+
+
+def _rebuild_rollups(conn, first_id=None, last_id=None):
+    """Recompute the completion rollups from the history, for all habits or an ID range."""
+    habit_filter, params = "", ()
+    if first_id is not None:
+        habit_filter, params = "WHERE habit_id BETWEEN ? AND ?", (first_id, last_id)
+    for table, period in ROLLUPS.values():
+        conn.execute(f"DELETE FROM {table} {habit_filter}", params)
+        conn.execute(f"""
+        INSERT INTO {table} (habit_id, period_ordinal, completions)
+        SELECT habit_id, {period}, COUNT(*) FROM completion_dates {habit_filter}
+        GROUP BY habit_id, {period}
+        """, params)
+
+
+def _add_rollups(conn):
+    # Completions per habit and day, ISO week and month, kept up to date by every insert
+    for table, _ in ROLLUPS.values():
+        conn.execute(f"""
+        CREATE TABLE {table} (
+            habit_id INTEGER NOT NULL,
+            period_ordinal INTEGER NOT NULL,
+            completions INTEGER NOT NULL,
+            PRIMARY KEY (habit_id, period_ordinal),
+            FOREIGN KEY (habit_id) REFERENCES habits(id)
+        ) WITHOUT ROWID
+        """)
+    _rebuild_rollups(conn)
+
+
+def _add_analytics_cache(conn):
+    # A write version per habit, bumped by every write to it; habit_id 0 holds the
+    # version of the habit set as a whole. Cached results are valid while the version
+    # they were computed at is current.
+    conn.execute("""
+    CREATE TABLE habit_write_versions (
+        habit_id INTEGER PRIMARY KEY,
+        write_version INTEGER NOT NULL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE analytics_cache (
+        habit_id INTEGER NOT NULL,
+        metric TEXT NOT NULL,
+        write_version INTEGER NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (habit_id, metric)
+    ) WITHOUT ROWID
+    """)
+
+
+# Ordered schema migrations as (version, description, step). A database whose
+# PRAGMA user_version is lower than a step's version still needs that step.
+MIGRATIONS = [
+    (1, "Add (habit_id, completion_datetime) index to completion_dates", _add_completion_index),
+    (2, "Store completion times as integer epoch, day and week ordinals", _store_completions_as_integers),
+    (3, "Enforce case-insensitive unique habit names with an index", _add_unique_habit_name_index),
+    (4, "Add incrementally maintained habit_streak_state table", _add_streak_state),
+    (5, "Add per-habit day bitmaps in habit_bitmaps", _add_day_bitmaps),
+    (6, "Add last_completion and a last_period index to habit_streak_state", _add_last_completion),
+    (7, "Add run-length encoded streak_segments table", _add_streak_segments),
+    (8, "Add per-day, per-week and per-month completion rollups", _add_rollups),
+    (9, "Add habit write versions and a persistent analytics cache", _add_analytics_cache),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
 
 class HabitDatabase:
-    def __init__(self, db_name="habits.db"):
-        """Initialize the database connection and create necessary tables."""
-        self.conn = sqlite3.connect(db_name)
+    def __init__(self, db_name="habits.db", migrate=True, profile=None, read_only=False):
+        """
+        Initialize the database connection, create necessary tables and apply pending migrations.
+
+        Args:
+            db_name (str, optional): Database file path, or ":memory:". Defaults to "habits.db".
+            migrate (bool, optional): Apply pending schema migrations. Defaults to True.
+            profile (str, optional): Performance profile name; see resolve_profile.
+            read_only (bool, optional): Open an existing database file read-only, without
+                creating tables, migrating or changing its journal mode. Defaults to False.
+        """
+        self.db_name = db_name
+        if read_only:
+            self.conn = sqlite3.connect(read_only_uri(db_name), uri=True)
+        else:
+            self.conn = sqlite3.connect(db_name)
+        self._transaction_depth = 0
+        self._write_count = 0  # Writes made through this connection; see get_change_token
+        self._rollback_count = 0  # Units of work rolled back on this connection
+        self.profile, pragmas = resolve_profile(profile)
+        for pragma, value in pragmas.items():
+            if read_only and pragma == "journal_mode":
+                continue  # Set by the writers; a read-only connection cannot change it
+            self.conn.execute(f"PRAGMA {pragma} = {value}")
+        if read_only:
+            return
         self.create_tables()
+        if migrate:
+            self.migrate()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run a block of statements as one unit of work.
+
+        The outermost block commits on success and rolls back on error. Nested blocks
+        become savepoints, so a failed inner block is undone without losing the rest of
+        the outer unit of work, and nothing is committed until the outermost block ends.
+        """
+        depth = self._transaction_depth
+        if depth == 0 and not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+        elif depth:
+            self.conn.execute(f"SAVEPOINT unit_of_work_{depth}")
+        self._transaction_depth += 1
+        try:
+            yield self.conn
+        except BaseException:
+            # The write versions bumped in the block are undone and will be handed out again
+            self._rollback_count += 1
+            if depth:
+                self.conn.execute(f"ROLLBACK TO unit_of_work_{depth}")
+                self.conn.execute(f"RELEASE unit_of_work_{depth}")
+            else:
+                self.conn.rollback()
+            raise
+        else:
+            if depth:
+                self.conn.execute(f"RELEASE unit_of_work_{depth}")
+            else:
+                self.conn.commit()
+        finally:
+            self._transaction_depth = depth
 
     def create_tables(self):
         """Create the habits and completion_dates tables if they don't exist."""
-        with self.conn:
+        with self.transaction():
             self.conn.execute("""
             CREATE TABLE IF NOT EXISTS habits (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -27,21 +573,164 @@ class HabitDatabase:
             )
             """)
 
+    def get_schema_version(self):
+        """Return the schema version recorded in the database file."""
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def get_settings(self):
+        """Return the active performance profile and the PRAGMA values the connection is using."""
+        settings = {"profile": self.profile}
+        for pragma in PROFILE_PRAGMAS:
+            settings[pragma] = self.conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+        # synchronous and temp_store are reported as numbers; show their names
+        settings["synchronous"] = ("OFF", "NORMAL", "FULL", "EXTRA")[settings["synchronous"]]
+        settings["temp_store"] = ("DEFAULT", "FILE", "MEMORY")[settings["temp_store"]]
+        return settings
+
+    def get_pending_migrations(self):
+        """Return the migrations that have not been applied to this database yet."""
+        version = self.get_schema_version()
+        return [migration for migration in MIGRATIONS if migration[0] > version]
+
+    def migrate(self, on_step=None):
+        """
+        Apply pending migrations in order, each one in its own transaction.
+
+        A failing step is rolled back and leaves the database at the previous version.
+
+        Args:
+            on_step (callable, optional): Called as on_step(version, description, seconds)
+                after each step is committed.
+
+        Returns:
+            list: A (version, description, seconds) tuple for every applied step.
+        """
+        applied = []
+        for version, description, step in self.get_pending_migrations():
+            start = time.perf_counter()
+            with self.transaction():
+                step(self.conn)
+                self.conn.execute(f"PRAGMA user_version = {int(version)}")
+            elapsed = time.perf_counter() - start
+            applied.append((version, description, elapsed))
+            if on_step:
+                on_step(version, description, elapsed)
+        if applied:
+            # Results cached by an older version of the code may no longer be right
+            self.clear_analytics_cache()
+        return applied
+
     def insert_habit(self, name, periodicity):
-        """Insert a new habit into the habits table."""
-        with self.conn:
-            self.conn.execute("""
+        """
+        Insert a new habit into the habits table and return its ID.
+
+        Raises:
+            ValueError: If a habit with the same name (ignoring case) already exists.
+        """
+        with self.transaction():
+            return self._insert_habit_row(name, periodicity, datetime.now().strftime("%Y-%m-%d"))
+
+    def _insert_habit_row(self, name, periodicity, creation_date):
+        """Insert a habit in the current transaction, turning a name clash into a ValueError."""
+        try:
+            habit_id = self.conn.execute("""
             INSERT INTO habits (name, periodicity, creation_date)
             VALUES (?, ?, ?)
-            """, (name, periodicity, datetime.now().strftime("%Y-%m-%d")))
+            """, (name, periodicity, creation_date)).lastrowid
+        except sqlite3.IntegrityError:
+            raise ValueError(f"The habit '{name}' already exists.") from None
+        self._bump_write_versions([habit_id])
+        return habit_id
+
+    def _bump_write_versions(self, habit_ids):
+        """Advance the write version of some habits and of the habit set (ID 0), in the current transaction."""
+        self._write_count += 1
+        self.conn.executemany("""
+        INSERT INTO habit_write_versions (habit_id, write_version) VALUES (?, 1)
+        ON CONFLICT (habit_id) DO UPDATE SET write_version = write_version + 1
+        """, [(habit_id,) for habit_id in {0, *habit_ids}])
+
+    def get_change_token(self):
+        """
+        Return a value that changes whenever the database may have been written to.
+
+        PRAGMA data_version changes when another connection commits, and the local
+        write count covers this connection's own writes, which data_version ignores.
+
+        Returns:
+            tuple: (data_version, write count, rollback count). A new rollback count means
+            that write versions read since the last token may have been undone.
+        """
+        return self.conn.execute("PRAGMA data_version").fetchone()[0], self._write_count, self._rollback_count
+
+    def get_write_version(self, habit_id):
+        """Return the write version of a habit, or of the habit set for ID 0."""
+        row = self.conn.execute("SELECT write_version FROM habit_write_versions WHERE habit_id = ?",
+                                (habit_id,)).fetchone()
+        return row[0] if row else 0
+
+    def get_analytics_cache_size(self):
+        """Return (entries, bytes of stored values) of the persistent analytics cache."""
+        return self.conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM analytics_cache").fetchone()
+
+    def get_cached_result(self, habit_id, metric):
+        """
+        Look up a cached analytics result with one query.
+
+        Args:
+            habit_id (int): The habit the result belongs to, or 0 for results over all habits.
+            metric (str): Name of the result.
+
+        Returns:
+            tuple: (current write version, value or None). The value is only returned if it
+            was stored at the current write version; pass the version to store_cached_result.
+        """
+        version, value = self.conn.execute("""
+        SELECT v.version, c.value
+        FROM (SELECT COALESCE((SELECT write_version FROM habit_write_versions WHERE habit_id = :habit_id), 0)
+              AS version) AS v
+        LEFT JOIN analytics_cache AS c
+            ON c.habit_id = :habit_id AND c.metric = :metric AND c.write_version = v.version
+        """, {"habit_id": habit_id, "metric": metric}).fetchone()
+        return version, json.loads(value) if value is not None else None
+
+    def store_cached_result(self, habit_id, metric, write_version, value):
+        """
+        Cache an analytics result computed at a given write version (as returned by get_cached_result).
+
+        A write committed while the result was being computed has already advanced the
+        version, so such a result is stored as stale rather than served.
+        """
+        with self.transaction():
+            self.conn.execute("""
+            INSERT OR REPLACE INTO analytics_cache (habit_id, metric, write_version, value) VALUES (?, ?, ?, ?)
+            """, (habit_id, metric, write_version, json.dumps(value)))
+
+    def clear_analytics_cache(self):
+        """
+        Drop every cached analytics result.
+
+        Writers that change the tables without going through HabitDatabase do not bump
+        the write versions and should call this afterwards.
+        """
+        with self.transaction():
+            self._write_count += 1
+            self.conn.execute("DELETE FROM analytics_cache")
 
     def delete_habit(self, habit_id):
         """Delete a habit by its ID."""
-        with self.conn:
-            # Eliminate the completion dates associated with this habit first.
+        with self.transaction():
+            # Eliminate the completion dates and streak state associated with this habit first.
             self.conn.execute("""
             DELETE FROM completion_dates WHERE habit_id = ?
             """, (habit_id,))
+            self.conn.execute("DELETE FROM habit_streak_state WHERE habit_id = ?", (habit_id,))
+            self.conn.execute("DELETE FROM habit_bitmaps WHERE habit_id = ?", (habit_id,))
+            self.conn.execute("DELETE FROM streak_segments WHERE habit_id = ?", (habit_id,))
+            for table, _ in ROLLUPS.values():
+                self.conn.execute(f"DELETE FROM {table} WHERE habit_id = ?", (habit_id,))
+            self.conn.execute("DELETE FROM analytics_cache WHERE habit_id = ?", (habit_id,))
+            self._bump_write_versions([habit_id])
             
             # Now eliminate the habit itself
             self.conn.execute("""
@@ -50,15 +739,13 @@ class HabitDatabase:
            
     def get_habit_by_id(self, habit_id):
         """Retrieve a single habit by its ID."""
-        with self.conn:
-            return self.conn.execute("SELECT * FROM habits WHERE id = ?", (habit_id,)).fetchone()
+        return self.conn.execute("SELECT * FROM habits WHERE id = ?", (habit_id,)).fetchone()
     
 
     def mark_habit_completed(self, habit_id,completion_datetime):
         """Mark a habit as completed by inserting a completion date and time into the database."""
         # Check if the habit exists
-        habits = self.get_habits()
-        if not any(h[0] == habit_id for h in habits):
+        if not self.get_habit_by_id(habit_id):
             raise ValueError(f"No habit found with ID {habit_id}.")
         
         # Insert the date and time of completion
@@ -67,43 +754,484 @@ class HabitDatabase:
 
 
     def insert_completion_datetime(self, habit_id, completion_datetime):
-        """Insert a completion date and time for a specific habit."""
-        with self.conn:
-            self.conn.execute("""
-            INSERT INTO completion_dates (habit_id, completion_datetime)
-            VALUES (?, ?)
-            """, (habit_id, completion_datetime))
+        """Insert a completion date and time (datetime or "YYYY-MM-DD HH:MM:SS" string) for a specific habit."""
+        with self.transaction():
+            self._insert_completion_rows([(habit_id, *encode_completion(completion_datetime))])
+
+    def _insert_completion_rows(self, rows):
+        """Insert encoded (habit_id, epoch, day, week) rows in the current transaction and update streak state, bitmaps and rollups."""
+        self.conn.executemany("""
+        INSERT INTO completion_dates (habit_id, completion_epoch, day_ordinal, week_ordinal)
+        VALUES (?, ?, ?, ?)
+        """, rows)
+        habit_ids = list({row[0] for row in rows})
+        placeholders = ", ".join("?" * len(habit_ids))
+        habits = {habit_id: (periodicity, creation_date) for habit_id, periodicity, creation_date in self.conn.execute(
+            f"SELECT id, periodicity, creation_date FROM habits WHERE id IN ({placeholders})", habit_ids)}
+        self._advance_streak_states(rows, habits)
+        self._add_to_bitmaps(rows, habits)
+        self._add_to_rollups(rows)
+        self._bump_write_versions(habits)
+
+    def _add_to_rollups(self, rows):
+        """Add newly inserted completion rows to the day, week and month counts."""
+        counts = {period: Counter() for period in ROLLUPS}
+        for habit_id, _, day, week in rows:
+            counts["day"][habit_id, day] += 1
+            counts["week"][habit_id, week] += 1
+        # Months only change between days, so convert each distinct day once
+        for (habit_id, day), count in counts["day"].items():
+            counts["month"][habit_id, month_ordinal(day)] += count
+        for period, (table, _) in ROLLUPS.items():
+            self.conn.executemany(f"""
+            INSERT INTO {table} (habit_id, period_ordinal, completions) VALUES (?, ?, ?)
+            ON CONFLICT (habit_id, period_ordinal) DO UPDATE SET completions = completions + excluded.completions
+            """, [(habit_id, period_ordinal, count) for (habit_id, period_ordinal), count in counts[period].items()])
+
+    def _add_to_bitmaps(self, rows, habits):
+        """Set the day bits of newly inserted completion rows in habit_bitmaps."""
+        placeholders = ", ".join("?" * len(habits))
+        bitmaps = {habit_id: DayBitmap(origin, bits) for habit_id, origin, bits in self.conn.execute(f"""
+            SELECT habit_id, origin_ordinal, bits FROM habit_bitmaps WHERE habit_id IN ({placeholders})
+            """, list(habits))}
+        for habit_id, _, day, _ in rows:
+            if habit_id not in habits:
+                continue
+            bitmap = bitmaps.get(habit_id)
+            if bitmap is None:
+                bitmap = bitmaps[habit_id] = DayBitmap(_creation_ordinal(habits[habit_id][1]))
+            bitmap.add(day)
+        self.conn.executemany("""
+        INSERT OR REPLACE INTO habit_bitmaps (habit_id, origin_ordinal, bits) VALUES (?, ?, ?)
+        """, [(habit_id, bitmap.origin, bytes(bitmap.bits)) for habit_id, bitmap in bitmaps.items()])
+
+    def _advance_streak_states(self, rows, habits):
+        """
+        Update habit_streak_state and streak_segments for newly inserted completion rows.
+
+        Rows are taken in (habit, period) order, so a chunk that is merely out of order
+        within itself still advances in O(1) per row: a completion in the last recorded
+        period or later extends or restarts the current run, and its segment. A completion
+        older than the stored state can join or split earlier runs, so the habits that got
+        one are recomputed instead, all of them in one pass; see _merge_streaks.
+        """
+        periodicities = {habit_id: habit[0] for habit_id, habit in habits.items()}
+        placeholders = ", ".join("?" * len(periodicities))
+        stored = {row[0]: row[1:] for row in self.conn.execute(f"""
+            SELECT habit_id, last_period, current_run, longest_run, last_completion FROM habit_streak_state
+            WHERE habit_id IN ({placeholders})
+            """, list(periodicities))}
+        states = {habit_id: list(state) for habit_id, state in stored.items()}
+
+        def period_of(row):
+            return row[3] if periodicities.get(row[0]) == "weekly" else row[2]
+
+        back_dated = set()
+        segments = {}  # (habit_id, start_period) -> end_period of the segments that changed
+        for habit_id, epoch, day, week in sorted(rows, key=lambda row: (row[0], period_of(row), row[1])):
+            if habit_id not in periodicities or habit_id in back_dated:
+                continue
+            period = week if periodicities[habit_id] == "weekly" else day
+            state = states.get(habit_id)
+            if state is None:
+                state = states[habit_id] = [period, 1, 1, epoch]
+            elif period == state[0] + 1:
+                state[0], state[1] = period, state[1] + 1
+                state[2] = max(state[2], state[1])
+            elif period > state[0] + 1:
+                state[0], state[1] = period, 1
+            elif period < state[0]:
+                back_dated.add(habit_id)
+                continue
+            state[3] = max(state[3] or epoch, epoch)
+            segments[habit_id, state[0] - state[1] + 1] = state[0]
+
+        self.conn.executemany("""
+        INSERT OR REPLACE INTO habit_streak_state (habit_id, last_period, current_run, longest_run, last_completion)
+        VALUES (?, ?, ?, ?, ?)
+        """, [(habit_id, *state) for habit_id, state in states.items() if habit_id not in back_dated])
+        self.conn.executemany("""
+        INSERT OR REPLACE INTO streak_segments (habit_id, start_period, end_period, length)
+        VALUES (?, ?, ?, ?)
+        """, [(habit_id, start, end, end - start + 1)
+              for (habit_id, start), end in segments.items() if habit_id not in back_dated])
+        if back_dated:
+            new_periods = {habit_id: set() for habit_id in back_dated}
+            back_dated_states = {habit_id: list(stored[habit_id]) for habit_id in back_dated}
+            for row in rows:
+                if row[0] in back_dated:
+                    new_periods[row[0]].add(period_of(row))
+                    state = back_dated_states[row[0]]
+                    state[3] = max(state[3] or row[1], row[1])
+            _merge_streaks(self.conn, new_periods, back_dated_states)
+
+
+    def insert_completions_bulk(self, completions, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Insert many completions, one executemany and one commit per chunk.
+
+        The input is consumed lazily, so it can be a generator over a very large source.
+        If it raises part way through, the chunks written before are kept. Inside an
+        enclosing transaction() the chunks are only committed with it.
+
+        Args:
+            completions (iterable): (habit_id, completion_datetime) pairs.
+            chunk_size (int, optional): Number of completions per transaction.
+
+        Returns:
+            int: The number of completions inserted.
+        """
+        inserted = 0
+        for chunk in chunked(completions, chunk_size):
+            rows = [(habit_id, *encode_completion(completion_datetime))
+                    for habit_id, completion_datetime in chunk]
+            with self.transaction():
+                self._insert_completion_rows(rows)
+            inserted += len(rows)
+        return inserted
 
 
     def get_habits(self):
         """Retrieve all habits from the habits table."""
-        with self.conn:
-            return self.conn.execute("SELECT * FROM habits").fetchall()
+        return self.conn.execute("SELECT * FROM habits").fetchall()
         
 
+    def has_habits(self):
+        """Return True if at least one habit is stored."""
+        return self.conn.execute("SELECT EXISTS (SELECT 1 FROM habits)").fetchone()[0] == 1
+
+
+    def get_habit_ids(self):
+        """Retrieve the set of all habit IDs."""
+        return {row[0] for row in self.conn.execute("SELECT id FROM habits")}
+
+
     def get_habits_by_periodicity(self, periodicity):
         """Retrieve all habits with a specific periodicity (daily or weekly)."""
-        with self.conn:
-            return self.conn.execute("""
-            SELECT * FROM habits WHERE periodicity = ?
-            """, (periodicity,)).fetchall()
+        return self.conn.execute("""
+        SELECT * FROM habits WHERE periodicity = ?
+        """, (periodicity,)).fetchall()
         
 
     def get_completion_dates(self, habit_id):
-        """Retrieve all completion dates for a specific habit."""
-        with self.conn:
-            return self.conn.execute("""
-            SELECT completion_datetime FROM completion_dates
-            WHERE habit_id = ?
-            """, (habit_id,)).fetchall()
+        """Retrieve all completion dates for a specific habit as "YYYY-MM-DD HH:MM:SS" strings, oldest first."""
+        return self.conn.execute("""
+        SELECT datetime(completion_epoch, 'unixepoch') FROM completion_dates
+        WHERE habit_id = ?
+        ORDER BY completion_epoch
+        """, (habit_id,)).fetchall()
+
+    def get_completions_between(self, habit_id, start, end):
+        """
+        Retrieve a habit's completions in a time window, oldest first, from a range scan of the covering index.
+
+        Args:
+            habit_id (int): The ID of the habit.
+            start (datetime or str): Start of the window, inclusive.
+            end (datetime or str): End of the window, exclusive, so consecutive windows do not overlap.
+
+        Returns:
+            list: ("YYYY-MM-DD HH:MM:SS",) rows, like get_completion_dates.
+        """
+        return self.conn.execute("""
+        SELECT datetime(completion_epoch, 'unixepoch') FROM completion_dates
+        WHERE habit_id = ? AND completion_epoch >= ? AND completion_epoch < ?
+        ORDER BY completion_epoch
+        """, (habit_id, encode_completion(start)[0], encode_completion(end)[0])).fetchall()
+
+    def count_completions_between(self, habit_id, start, end):
+        """Count a habit's completions from start (inclusive) to end (exclusive) without reading them."""
+        return self.conn.execute("""
+        SELECT COUNT(*) FROM completion_dates
+        WHERE habit_id = ? AND completion_epoch >= ? AND completion_epoch < ?
+        """, (habit_id, encode_completion(start)[0], encode_completion(end)[0])).fetchone()[0]
+
+    def get_completion_epochs(self, habit_id):
+        """Retrieve a habit's completion times as epoch seconds, ascending."""
+        return [row[0] for row in self.conn.execute("""
+            SELECT completion_epoch FROM completion_dates WHERE habit_id = ? ORDER BY completion_epoch
+            """, (habit_id,))]
+
+    def get_completion_periods(self, habit_id, periodicity):
+        """
+        Retrieve the day ordinals (daily) or ISO-week ordinals (weekly) with a completion of a habit.
+
+        The ordinals are read from the day or week rollup, so they come ascending and
+        without repeats, one row per period rather than per completion.
+        """
+        table = ROLLUPS["week" if periodicity == "weekly" else "day"][0]
+        return [row[0] for row in self.conn.execute(f"""
+            SELECT period_ordinal FROM {table} WHERE habit_id = ? ORDER BY period_ordinal
+            """, (habit_id,))]
+
+    def get_completion_counts(self, period, habit_id=None, start_period=None, end_period=None):
+        """
+        Retrieve completion counts per habit and period from the rollups.
+
+        Args:
+            period (str): "day", "week" or "month".
+            habit_id (int, optional): Only count this habit.
+            start_period (int, optional): First period ordinal to include.
+            end_period (int, optional): Last period ordinal to include.
+
+        Returns:
+            list: (habit_id, period_ordinal, completions) tuples ordered by habit and period.
+        """
+        if period not in ROLLUPS:
+            raise ValueError(f"Unknown period '{period}'. Choose from: {', '.join(ROLLUPS)}.")
+        conditions = []
+        if habit_id is not None:
+            conditions.append("habit_id = :habit_id")
+        if start_period is not None:
+            conditions.append("period_ordinal >= :start_period")
+        if end_period is not None:
+            conditions.append("period_ordinal <= :end_period")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.conn.execute(f"""
+        SELECT habit_id, period_ordinal, completions FROM {ROLLUPS[period][0]}
+        {where}
+        ORDER BY habit_id, period_ordinal
+        """, {"habit_id": habit_id, "start_period": start_period, "end_period": end_period}).fetchall()
+
+    def rebuild_rollups(self, batch_size=ROLLUP_BATCH_SIZE, on_batch=None):
+        """
+        Recompute every completion rollup from the history, a batch of habits per transaction.
+
+        Each batch covers a range of habit IDs, so it reads its completions with range
+        scans of the covering index and holds the write lock only briefly.
+
+        Args:
+            batch_size (int, optional): Habits per batch.
+            on_batch (callable, optional): Called as on_batch(habits done, total habits) after each batch.
+
+        Returns:
+            int: The number of habits processed.
+        """
+        habit_ids = sorted(self.get_habit_ids())
+        with self.transaction():
+            # Counts left over from habits that no longer exist
+            for table, _ in ROLLUPS.values():
+                self.conn.execute(f"DELETE FROM {table} WHERE habit_id NOT IN (SELECT id FROM habits)")
+        for done in range(0, len(habit_ids), batch_size):
+            batch = habit_ids[done:done + batch_size]
+            with self.transaction():
+                _rebuild_rollups(self.conn, batch[0], batch[-1])
+            if on_batch:
+                on_batch(done + len(batch), len(habit_ids))
+        return len(habit_ids)
         
         
+    def iter_completions(self, habit_id=None, batch_size=STREAM_BATCH_SIZE, id_range=None):
+        """
+        Stream every habit's completions from one ordered join, fetching a batch at a time.
+
+        Rows come grouped by habit ID and oldest first within a habit, straight from the
+        habits primary key and the covering completion index, so no sort is needed and
+        only one batch is held in memory whatever the number of habits or completions.
+
+        Args:
+            habit_id (int, optional): Only stream this habit.
+            batch_size (int, optional): Rows per fetchmany call.
+            id_range (tuple, optional): (first, last) habit IDs to stream, inclusive.
+
+        Yields:
+            tuple: (habit_id, periodicity, day_ordinal, week_ordinal). A habit without
+            completions yields a single row with None ordinals.
+        """
+        habit_filter, params = "", ()
+        if habit_id is not None:
+            habit_filter, params = "WHERE h.id = ?", (habit_id,)
+        elif id_range is not None:
+            habit_filter, params = "WHERE h.id BETWEEN ? AND ?", tuple(id_range)
+        cursor = self.conn.execute(f"""
+        SELECT h.id, h.periodicity, c.day_ordinal, c.week_ordinal
+        FROM habits AS h LEFT JOIN completion_dates AS c ON c.habit_id = h.id
+        {habit_filter}
+        ORDER BY h.id, c.completion_epoch
+        """, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield from rows
+
+    def get_longest_streaks(self, habit_id=None):
+        """
+        Compute the longest streak of every habit (or of one habit) in a single
+        gaps-and-islands query over the completion history.
+
+        Args:
+            habit_id (int, optional): Restrict the result to this habit.
+
+        Returns:
+            list: (habit_id, longest_streak) tuples ordered by habit ID, with 0 for
+            habits that have no completions.
+        """
+        habit_filter = "WHERE h.id = :habit_id" if habit_id is not None else ""
+        return self.conn.execute(_streak_runs_cte(habit_filter) + f"""
+        SELECT h.id, COALESCE(MAX(r.run_length), 0)
+        FROM habits AS h LEFT JOIN runs AS r ON r.habit_id = h.id
+        {habit_filter}
+        GROUP BY h.id
+        ORDER BY h.id
+        """, {"habit_id": habit_id}).fetchall()
+
+
+    def get_streak_state(self, habit_id):
+        """Return (last_period, current_run, longest_run) for a habit, or None if it has no completions."""
+        return self.conn.execute("""
+        SELECT last_period, current_run, longest_run FROM habit_streak_state WHERE habit_id = ?
+        """, (habit_id,)).fetchone()
+
+    def get_streak_segments(self, habit_id, start_period=None, end_period=None, min_length=None):
+        """
+        Retrieve a habit's streaks from streak_segments, oldest first.
+
+        Args:
+            habit_id (int): The ID of the habit.
+            start_period (int, optional): Only streaks that end on or after this period.
+            end_period (int, optional): Only streaks that start on or before this period.
+            min_length (int, optional): Only streaks at least this long.
+
+        Periods are day ordinals, or ISO-week ordinals for weekly habits.
+
+        Returns:
+            list: (start_period, end_period, length) tuples.
+        """
+        conditions = ["habit_id = :habit_id"]
+        if start_period is not None:
+            conditions.append("end_period >= :start_period")
+        if end_period is not None:
+            conditions.append("start_period <= :end_period")
+        if min_length is not None:
+            conditions.append("length >= :min_length")
+        return self.conn.execute(f"""
+        SELECT start_period, end_period, length FROM streak_segments
+        WHERE {' AND '.join(conditions)}
+        ORDER BY start_period
+        """, {"habit_id": habit_id, "start_period": start_period, "end_period": end_period,
+              "min_length": min_length}).fetchall()
+
+    def get_streak_segment_at(self, habit_id, period):
+        """Return the (start_period, end_period, length) streak that contains a period or ends just before it, or None."""
+        # The latest streak starting by then is the only candidate: one primary key probe
+        segment = self.conn.execute("""
+        SELECT start_period, end_period, length FROM streak_segments
+        WHERE habit_id = ? AND start_period <= ?
+        ORDER BY start_period DESC LIMIT 1
+        """, (habit_id, period)).fetchone()
+        return segment if segment and segment[1] >= period - 1 else None
+
+    def get_due_habits(self, day_ordinal, at_risk_only=False):
+        """
+        Find the habits not completed yet in the period containing a given day.
+
+        Answered from habit_streak_state alone. With at_risk_only, only habits whose
+        streak ends in the previous period, and so breaks unless they are completed in
+        this one, are returned. Day and week ordinals never overlap, so that case is one
+        lookup of two values on the last_period index.
+
+        Args:
+            day_ordinal (int): The current day, as date.toordinal().
+            at_risk_only (bool, optional): Skip habits with no streak to lose.
+
+        Returns:
+            list: (habit_id, name, periodicity, current_streak, last_completion) tuples ordered
+            by habit ID; last_completion is a "YYYY-MM-DD HH:MM:SS" string or None.
+        """
+        params = {"day": day_ordinal, "week": week_ordinal(day_ordinal)}
+        current_period = "CASE h.periodicity WHEN 'weekly' THEN :week ELSE :day END"
+        if at_risk_only:
+            source = "habit_streak_state AS s JOIN habits AS h ON h.id = s.habit_id"
+            condition = f"s.last_period IN (:day - 1, :week - 1) AND s.last_period = {current_period} - 1"
+        else:
+            source = "habits AS h LEFT JOIN habit_streak_state AS s ON s.habit_id = h.id"
+            condition = f"s.last_period IS NULL OR s.last_period < {current_period}"
+        return self.conn.execute(f"""
+        SELECT h.id, h.name, h.periodicity,
+               CASE WHEN s.last_period = {current_period} - 1 THEN s.current_run ELSE 0 END,
+               datetime(s.last_completion, 'unixepoch')
+        FROM {source}
+        WHERE {condition}
+        ORDER BY h.id
+        """, params).fetchall()
+
+    def get_longest_streaks_from_state(self):
+        """Return (habit_id, longest_run) for every habit from habit_streak_state, 0 if it has no completions."""
+        return self.conn.execute("""
+        SELECT h.id, COALESCE(s.longest_run, 0)
+        FROM habits AS h LEFT JOIN habit_streak_state AS s ON s.habit_id = h.id
+        ORDER BY h.id
+        """).fetchall()
+
+    def get_max_longest_streak(self):
+        """Return the longest streak recorded for any habit, with a single MAX() over habit_streak_state."""
+        return self.conn.execute("SELECT COALESCE(MAX(longest_run), 0) FROM habit_streak_state").fetchone()[0]
+
+
+    def get_day_bitmaps(self, habit_ids=None):
+        """
+        Load the day bitmaps of some or all habits.
+
+        Args:
+            habit_ids (iterable, optional): Only load these habits. Defaults to every habit.
+
+        Returns:
+            dict: habit_id -> (periodicity, DayBitmap). Habits without completions get an
+            empty bitmap.
+        """
+        query = """
+        SELECT h.id, h.periodicity, h.creation_date, b.origin_ordinal, b.bits
+        FROM habits AS h LEFT JOIN habit_bitmaps AS b ON b.habit_id = h.id
+        """
+        params = []
+        if habit_ids is not None:
+            params = list(habit_ids)
+            query += f"WHERE h.id IN ({', '.join('?' * len(params))})"
+        return {habit_id: (periodicity, DayBitmap(origin, bits) if bits is not None
+                           else DayBitmap(_creation_ordinal(creation_date)))
+                for habit_id, periodicity, creation_date, origin, bits in self.conn.execute(query, params)}
+
+
     def delete_all_habits(self):
         """Elimina todos los hábitos y sus registros de completado en la base de datos."""
-        with self.conn:
+        with self.transaction():
              self.conn.execute("DELETE FROM completion_dates")  # Remove all dates from completed
+             self.conn.execute("DELETE FROM habit_streak_state")  # Remove all streak state
+             self.conn.execute("DELETE FROM habit_bitmaps")  # Remove all day bitmaps
+             self.conn.execute("DELETE FROM streak_segments")  # Remove all streak segments
+             for table, _ in ROLLUPS.values():
+                 self.conn.execute(f"DELETE FROM {table}")  # Remove all completion counts
+             self.conn.execute("DELETE FROM analytics_cache")  # Remove all cached results
+             self._bump_write_versions([])
              self.conn.execute("DELETE FROM habits")  # Eliminate all habits
     
+    def replace_all_habits(self, habits, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Delete every habit and insert new ones, all in a single transaction.
+
+        Args:
+            habits (iterable): (name, periodicity, completions) tuples, where completions
+                is an iterable of completion datetimes. Each one is consumed before the
+                next habit is read, so both levels can be streamed.
+            chunk_size (int, optional): Completions per executemany call.
+
+        Returns:
+            tuple: (number of habits, number of completions) inserted.
+        """
+        habit_count = completion_count = 0
+        creation_date = datetime.now().strftime("%Y-%m-%d")
+        with self.transaction():
+            self.delete_all_habits()
+            for name, periodicity, completions in habits:
+                habit_id = self._insert_habit_row(name, periodicity, creation_date)
+                habit_count += 1
+                for chunk in chunked(completions, chunk_size):
+                    self._insert_completion_rows(
+                        [(habit_id, *encode_completion(completion_datetime)) for completion_datetime in chunk])
+                    completion_count += len(chunk)
+        return habit_count, completion_count
+
     def close(self):
         """Close the database connection."""
         self.conn.close()
@@ -1,43 +1,59 @@
-from db_manager import HabitDatabase
+from db_manager import HabitDatabase, BULK_CHUNK_SIZE
 from datetime import datetime
 
 class HabitManager:
-    def __init__(self):
-        """Initialize the habit manager and database connection."""
-        self.db = HabitDatabase()
+    def __init__(self, db=None):
+        """
+        Initialize the habit manager with a database connection.
 
+        Args:
+            db (HabitDatabase, optional): The database instance to share. Defaults to a new
+                connection to the default database.
+        """
+        self.db = db if db else HabitDatabase()
+        self._write_listeners = []
+
+    def add_write_listener(self, listener):
+        """
+        Register a callable to be told about writes, e.g. to invalidate cached analytics.
+
+        It is called as listener(habit_ids) after each write with the IDs of the habits
+        whose completions or existence changed.
+        """
+        self._write_listeners.append(listener)
+
+    def _notify_write(self, habit_ids):
+        """Call every write listener with the IDs of the habits just written."""
+        for listener in self._write_listeners:
+            listener(habit_ids)
 
     def create_habit(self, name, periodicity):
         """Create a new habit with the given name and periodicity."""
         if not name or not periodicity:
             raise ValueError("Name and periodicity are required to create a habit.")
-        existing_habits = self.db.get_habits()
-        if any(h[1].lower() == name.lower() for h in existing_habits):
-            raise ValueError(f"The habit '{name}' already exists.")
-        
-        # Inserting the habit into the database
-        self.db.insert_habit(name, periodicity)
+
+        # Inserting the habit into the database; the unique name index rejects duplicates
+        habit_id = self.db.insert_habit(name, periodicity)
+        self._notify_write({habit_id})
         print(f"Habit '{name}' with periodicity '{periodicity}' has been created.")
 
 
     def delete_habit(self, habit_id):
         """Delete a habit by its ID with validation checks."""
-        habits = self.db.get_habits()
-        if not habits:
-            raise ValueError("No habits found in the database.")
-
         habit = self.db.get_habit_by_id(habit_id)
         if not habit:
+            if not self.db.has_habits():
+                raise ValueError("No habits found in the database.")
             raise ValueError(f"No habit found with ID {habit_id}.")
 
         self.db.delete_habit(habit_id)
+        self._notify_write({habit_id})
         print(f"Habit with ID {habit_id} has been deleted.")
 
         
     def mark_habit_completed(self, habit_id, completion_datetime):
         """Mark a habit as completed."""
-        habits = self.db.get_habits()
-        if not any(h[0] == habit_id for h in habits):
+        if not self.db.get_habit_by_id(habit_id):
             raise ValueError(f"No habit found with ID {habit_id}.")
         
         now = datetime.now()
@@ -45,8 +61,46 @@ class HabitManager:
             raise ValueError("Completion date cannot be in the future.")
         
         self.db.insert_completion_datetime(habit_id, completion_datetime)
+        self._notify_write({habit_id})
         print(f"Habit with ID {habit_id} has been marked as completed at {completion_datetime}.")
-        
+
+
+    def mark_habits_completed_bulk(self, completions, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Mark many habits as completed, e.g. for a backfill.
+
+        All habit IDs are checked against a single query of the existing IDs, and the
+        completions are streamed to the database in chunks committed one at a time.
+        A ValueError stops the import at the offending completion; chunks already
+        committed are kept.
+
+        Args:
+            completions (iterable): (habit_id, completion_datetime) pairs.
+            chunk_size (int, optional): Number of completions per transaction.
+
+        Returns:
+            int: The number of completions recorded.
+        """
+        habit_ids = self.db.get_habit_ids()
+        written = set()
+        now = datetime.now()
+
+        def validated():
+            for habit_id, completion_datetime in completions:
+                if habit_id not in habit_ids:
+                    raise ValueError(f"No habit found with ID {habit_id}.")
+                if completion_datetime > now:
+                    raise ValueError("Completion date cannot be in the future.")
+                written.add(habit_id)
+                yield habit_id, completion_datetime
+
+        try:
+            count = self.db.insert_completions_bulk(validated(), chunk_size)
+        finally:
+            self._notify_write(written)  # Chunks committed before an error are kept
+        print(f"{count} completions have been recorded.")
+        return count
+
 
     def close(self):
         """Close the database connection."""
@@ -0,0 +1,97 @@
+import sys
+from collections import OrderedDict
+
+# Default limits of an LRUCache.
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_MAX_BYTES = 16 * 2**20
+
+
+def approximate_size(value):
+    """
+    Estimate the memory held by a value, in bytes.
+
+    Containers are measured together with their items, and objects with their
+    attributes. Shared objects are counted every time they are reached, so the
+    estimate errs on the high side.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, bytearray, int, float)):
+        return size
+    if isinstance(value, dict):
+        return size + sum(approximate_size(key) + approximate_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(map(approximate_size, value))
+    if hasattr(value, "__dict__"):
+        return size + approximate_size(vars(value))
+    return size  # array.array and other flat objects include their buffer
+
+
+class LRUCache:
+    """
+    A least-recently-used cache bounded by entry count and by approximate size.
+
+    Keys are tuples whose first item is a habit ID, so that all entries of a habit
+    can be invalidated at once. Hits, misses, evictions and invalidations are counted.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            max_entries (int, optional): Most entries kept at once.
+            max_bytes (int, optional): Most bytes, as estimated by approximate_size, kept at once.
+        """
+        if max_entries < 1 or max_bytes < 1:
+            raise ValueError("Cache limits must be positive.")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size), least recently used first
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Return the value cached under key, marking it as recently used, or default."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        """Cache a value, evicting the least recently used entries beyond the limits."""
+        size = approximate_size(value)
+        if key in self._entries:
+            self.bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def invalidate(self, habit_ids):
+        """Drop every entry whose key starts with one of the habit IDs."""
+        habit_ids = set(habit_ids)
+        for key in [key for key in self._entries if key[0] in habit_ids]:
+            self.bytes -= self._entries.pop(key)[1]
+            self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry, keeping the counters."""
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """Return the counters and current size as a dict."""
+        return {"entries": len(self._entries), "bytes": self.bytes,
+                "max_entries": self.max_entries, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations}
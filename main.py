@@ -1,65 +1,118 @@
 import click
-from db_manager import HabitDatabase
-from analytics import Analytics
-from habit_manager import HabitManager  
-from datetime import datetime
-import json
+import functools
+import time
+from session import HabitSession
+from db_manager import PERFORMANCE_PROFILES, PROFILE_ENV_VAR, CONFIG_FILE, DEFAULT_PROFILE, ROLLUP_BATCH_SIZE
+from analytics import Analytics, STREAK_ENGINES, DEFAULT_STREAK_ENGINE, METRICS
+from seeder import load_seed_file
+from timestamps import parse_timestamp
+from datetime import timedelta
+
+
+def in_unit_of_work(f):
+    """Pass the command the CLI session and run the command body as one transaction."""
+    @click.pass_obj
+    @functools.wraps(f)
+    def wrapper(session, *args, **kwargs):
+        with session.unit_of_work():
+            return f(session, *args, **kwargs)
+    return wrapper
+
+
+# Commands that read other database files and never open --db
+SESSIONLESS_COMMANDS = {"fleet"}
+
+# Lets the streak commands choose how streaks are computed
+engine_option = click.option('--engine', type=click.Choice(STREAK_ENGINES), default=DEFAULT_STREAK_ENGINE,
+                             show_default=True, help="Streak engine to use.")
 
-# Single instance for interacting with the database and analysis
-db = HabitDatabase("habits.db")
-analytics = Analytics(db)
 
 @click.group()
-def cli():
+@click.option('--db', 'db_name', default='habits.db', show_default=True, help="Database file to use.")
+@click.option('--profile', type=click.Choice(list(PERFORMANCE_PROFILES)), default=None,
+              help=f"Performance profile. Defaults to ${PROFILE_ENV_VAR}, then {CONFIG_FILE}, then '{DEFAULT_PROFILE}'.")
+@click.pass_context
+def cli(ctx, db_name, profile):
     """Habit Tracker CLI"""
     click.echo("Welcome to Habit Tracker CLI!")
     click.echo("Usage: main.py [OPTIONS] COMMAND [ARGS]...")
+    if ctx.invoked_subcommand in SESSIONLESS_COMMANDS:
+        return  # Otherwise --db would be created, and could then match the command's own paths
+    # One connection per invocation, shared by every part of the command.
+    # Migrations are applied here so that the migrate command can report them.
+    try:
+        session = HabitSession(db_name, migrate=False, profile=profile)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    ctx.obj = session
+    ctx.call_on_close(session.close)
+    if ctx.invoked_subcommand != "migrate":
+        session.db.migrate()
 
 
+# Command to upgrade the database schema
 @cli.command()
-def load_predefined_habits():
-    """Delete existing habits and load predefined habits from a JSON file."""
+@click.pass_obj
+def migrate(session):
+    """Apply pending schema migrations and report the time spent on each step."""
+    db = session.db
+
+    def report(version, description, seconds):
+        click.echo(f"Applied migration {version}: {description} ({seconds:.3f}s)")
+
     try:
-        # Opens the JSON file with the default habits
-        with open('habit_data.json', 'r') as f:
-            habit_data = json.load(f)
-        
-        habit_manager = HabitManager()
-        
-        # Eliminate all existing habits before loading new habits
-        with db.conn:
-            db.delete_all_habits()
-        click.echo("Previous habits deleted.")
-
-        # Inserting the new habits
-        for habit in habit_data['habits']:
-            habit_manager.create_habit(habit['name'], habit['periodicity'])
-            
-            
-            habits = db.get_habits()  
-            habit_id = next((h[0] for h in habits if h[1] == habit['name']), None)
-
-            if habit_id:
-                for completion_datetime_str in habit['completion_datetime']:
-                    completion_datetime = datetime.strptime(completion_datetime_str, "%Y-%m-%d %H:%M:%S")
-                    habit_manager.mark_habit_completed(habit_id, completion_datetime)
-        
-        click.echo("Predefined habits loaded successfully!")
+        applied = db.migrate(on_step=report)
+    except Exception as e:
+        click.echo(f"Error: migration failed, database left at version {db.get_schema_version()}: {str(e)}")
+        return
+
+    if not applied:
+        click.echo("No pending migrations.")
+    click.echo(f"Database schema is at version {db.get_schema_version()}.")
+
+
+# Command to show the database settings
+@cli.command()
+@click.pass_obj
+def info(session):
+    """Show the database file, schema version and active performance settings."""
+    db = session.db
+    click.echo(f"Database: {db.db_name}")
+    click.echo(f"Schema version: {db.get_schema_version()}")
+    for setting, value in db.get_settings().items():
+        click.echo(f"{setting}: {value}")
 
+
+@cli.command()
+@click.option('--file', 'path', default='habit_data.json', show_default=True, help="Seed file to load.")
+@in_unit_of_work
+def load_predefined_habits(session, path):
+    """Delete existing habits and load predefined habits from a JSON file."""
+    try:
+        # Streams the file and replaces every habit in a single transaction
+        habit_count, completion_count, seconds = load_seed_file(session.db, path)
     except FileNotFoundError:
-        click.echo("Error: 'habit_data.json' file not found.")
+        click.echo(f"Error: '{path}' file not found.")
+        return
     except Exception as e:
         click.echo(f"Error: {str(e)}")
+        return
+
+    click.echo("Previous habits deleted.")
+    click.echo("Predefined habits loaded successfully!")
+    rows = habit_count + completion_count
+    click.echo(f"Loaded {habit_count} habits and {completion_count} completions in {seconds:.3f}s "
+               f"({rows / seconds if seconds else rows:,.0f} rows/sec).")
 
 # Command to create a habit
 @cli.command()
 @click.argument('name')
 @click.argument('periodicity', type=click.Choice(['daily', 'weekly'], case_sensitive=False))
-def create(name, periodicity):
+@in_unit_of_work
+def create(session, name, periodicity):
     """Create a new habit with a name and periodicity (daily/weekly)."""
     try:
-        habit_manager = HabitManager()  # Instantiate HabitManager
-        habit_manager.create_habit(name, periodicity)  # Call create_habit method from HabitManager
+        session.habit_manager.create_habit(name, periodicity)  # Call create_habit method from HabitManager
         click.echo(f"Created habit: {name} with periodicity: {periodicity}")
     except ValueError as e:
         click.echo(f"Error: {str(e)}")  # Handle any error, such as a duplicate habit name
@@ -67,11 +120,11 @@ def create(name, periodicity):
 # Command to eliminate a habit
 @cli.command()
 @click.argument('habit_id', type=int)
-def delete(habit_id):
+@in_unit_of_work
+def delete(session, habit_id):
     """Delete a habit by its ID."""
     try:
-        habit_manager = HabitManager()  # Instantiate HabitManager
-        habit_manager.delete_habit(habit_id)  # Call delete_habit method from HabitManager
+        session.habit_manager.delete_habit(habit_id)  # Call delete_habit method from HabitManager
         click.echo(f"Deleted habit with ID: {habit_id}")
     except ValueError as e:
         click.echo(f"Error: {str(e)}") 
@@ -80,37 +133,39 @@ def delete(habit_id):
 @cli.command()
 @click.argument('habit_id', type=int)
 @click.argument('datetime_str')
-def complete(habit_id, datetime_str):
+@in_unit_of_work
+def complete(session, habit_id, datetime_str):
     """Mark a habit as completed with a manually entered date and time (YYYY-MM-DD HH:MM:SS)."""
     try:
         # Converts the date that comes as a string to a datetime object
-        completion_datetime = datetime.strptime(datetime_str, "%Y-%m-%d %H:%M:%S")
+        completion_datetime = parse_timestamp(datetime_str)
     except ValueError:
         click.echo("Error: Incorrect datetime format. Use 'YYYY-MM-DD HH:MM:SS'.")
         return
 
     try:
-        habit_manager = HabitManager()
-        habit_manager.mark_habit_completed(habit_id, completion_datetime)  # We pass datetime directly
+        session.habit_manager.mark_habit_completed(habit_id, completion_datetime)  # We pass datetime directly
         
     except ValueError as e:
         click.echo(f"Error: {str(e)}")
 
 # Command to list all current habits
 @cli.command()
-def list_habits():
+@in_unit_of_work
+def list_habits(session):
     """List all current habits."""
     click.echo("Current habits:")
-    habits = db.get_habits()
+    habits = session.db.get_habits()
     for habit in habits:
         click.echo(f"ID: {habit[0]}, Name: {habit[1]}, Periodicity: {habit[2]}")
 
 # Command to list habits by periodicity
 @cli.command()
 @click.argument('periodicity', type=click.Choice(['daily', 'weekly'], case_sensitive=False))
-def list_by_periodicity(periodicity):
+@in_unit_of_work
+def list_by_periodicity(session, periodicity):
     """List all habits with a specific periodicity (daily or weekly)."""
-    habits = db.get_habits_by_periodicity(periodicity)
+    habits = session.db.get_habits_by_periodicity(periodicity)
     if habits:
         click.echo(f"Habits with periodicity '{periodicity}':")
         for habit in habits:
@@ -122,15 +177,17 @@ def list_by_periodicity(periodicity):
 # Command to query streaks
 @cli.command()
 @click.argument('habit_id', type=int)
-def longest_streak_per_habit(habit_id):
+@engine_option
+@in_unit_of_work
+def longest_streak_per_habit(session, habit_id, engine):
     """Show the longest streak for a specific habit."""
     
     # Get the habit and its periodicity
-    habit = db.get_habit_by_id(habit_id)
+    habit = session.db.get_habit_by_id(habit_id)
     
     if habit:
         habit_periodicity = habit[2]  # Assuming periodicity is in index 2 of the tuple
-        longest_streak = analytics.get_longest_streak_for_habit(habit_id)
+        longest_streak = session.analytics.get_longest_streak_for_habit(habit_id, engine)
         
         # Display the longest streak
         click.echo(f"The longest streak for habit with ID {habit_id} is {longest_streak} {'weeks' if habit_periodicity == 'weekly' else 'days'}.")
@@ -140,18 +197,180 @@ def longest_streak_per_habit(habit_id):
 
 # Command to look up the longest overall streak
 @cli.command()
-def longest_streak():
+@engine_option
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help="Compute with the stream engine in this many processes instead.")
+@in_unit_of_work
+def longest_streak(session, engine, workers):
     """Show the longest streak across all habits."""
-    longest_streak = analytics.get_longest_streak()
+    if workers:
+        longest_streak = max(session.analytics.get_longest_streaks_parallel(workers).values(), default=0)
+    else:
+        longest_streak = session.analytics.get_longest_streak(engine)
     click.echo(f"The longest streak across all habits is {longest_streak} days.")
 
+
+# Command to list the habits still to do in the current period
+@cli.command()
+@click.option('--at-risk', is_flag=True, help="Only list habits whose streak breaks if not completed now.")
+@in_unit_of_work
+def due(session, at_risk):
+    """List habits not completed yet today (daily) or this week (weekly), with their current streak."""
+    habits = session.analytics.get_due_habits(at_risk_only=at_risk)
+    if not habits:
+        click.echo("No habits at risk." if at_risk else "All habits are done for now.")
+        return
+    for habit_id, name, periodicity, current_streak, last_completion in habits:
+        unit = "weeks" if periodicity == "weekly" else "days"
+        status = f"{current_streak} {unit} streak breaks if not completed {'this week' if periodicity == 'weekly' else 'today'}" \
+            if current_streak else "no current streak"
+        click.echo(f"ID: {habit_id}, Name: {name}, Periodicity: {periodicity}, "
+                   f"Last completed: {last_completion or 'never'}, {status}")
+
+
+# Command to show the current streak of a habit
+@cli.command()
+@click.argument('habit_id', type=int)
+@in_unit_of_work
+def current_streak(session, habit_id):
+    """Show the streak a habit still has going."""
+    habit = session.db.get_habit_by_id(habit_id)
+    if habit:
+        streak = session.analytics.get_current_streak(habit_id)
+        click.echo(f"The current streak for habit with ID {habit_id} is {streak} {'weeks' if habit[2] == 'weekly' else 'days'}.")
+    else:
+        click.echo(f"No habit found with ID {habit_id}.")
+
+
+# Command to list the completions of a habit in a date range
+@cli.command()
+@click.argument('habit_id', type=int)
+@click.option('--from', 'start', type=click.DateTime(formats=["%Y-%m-%d"]), required=True, help="First day (YYYY-MM-DD).")
+@click.option('--to', 'end', type=click.DateTime(formats=["%Y-%m-%d"]), required=True, help="Last day (YYYY-MM-DD).")
+@in_unit_of_work
+def completions(session, habit_id, start, end):
+    """List the completions of a habit between two days (inclusive)."""
+    if not session.db.get_habit_by_id(habit_id):
+        click.echo(f"No habit found with ID {habit_id}.")
+        return
+    # Only the window is read, from the (habit_id, completion_epoch) index
+    rows = session.db.get_completions_between(habit_id, start, end + timedelta(days=1))
+    click.echo(f"{len(rows)} completions from {start:%Y-%m-%d} to {end:%Y-%m-%d}:")
+    for row in rows:
+        click.echo(row[0])
+
+
+# Command to count completions per period
+@cli.command()
+@click.argument('habit_id', type=int, required=False)
+@click.option('--period', type=click.Choice(['day', 'week', 'month']), default='week', show_default=True,
+              help="Period to count completions by.")
+@click.option('--from', 'start', type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="First day (YYYY-MM-DD).")
+@click.option('--to', 'end', type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Last day (YYYY-MM-DD).")
+@in_unit_of_work
+def report(session, habit_id, period, start, end):
+    """Count the completions of every habit, or of one habit, per day, week or month."""
+    names = {habit[0]: habit[1] for habit in session.db.get_habits()}
+    if habit_id is not None and habit_id not in names:
+        click.echo(f"No habit found with ID {habit_id}.")
+        return
+    counts = session.analytics.get_completion_counts(period, start and start.date(), end and end.date(), habit_id)
+    if not counts:
+        click.echo("No completions found.")
+    label = {"day": "%Y-%m-%d", "week": "week of %Y-%m-%d", "month": "%Y-%m"}[period]
+    for counted_id, periods in counts.items():
+        click.echo(f"ID: {counted_id}, Name: {names[counted_id]}")
+        for first_day, completions in periods:
+            click.echo(f"  {first_day.strftime(label)}: {completions}")
+
+
+# Command to recompute the completion rollups
+@cli.command()
+@click.option('--batch-size', type=int, default=ROLLUP_BATCH_SIZE, show_default=True, help="Habits per transaction.")
+@click.pass_obj
+def rebuild_rollups(session, batch_size):
+    """Recompute the per-day, per-week and per-month completion counts from the history."""
+    def report_batch(done, total):
+        click.echo(f"Rebuilt rollups for {done}/{total} habits.")
+
+    start = time.perf_counter()
+    total = session.db.rebuild_rollups(batch_size, on_batch=report_batch)
+    click.echo(f"Rebuilt rollups for {total} habits in {time.perf_counter() - start:.3f}s.")
+
+
+# Command to show the analytics cache counters
+@cli.command()
+@click.pass_obj
+def cache_stats(session):
+    """Show the in-process analytics cache counters and the size of the persistent cache."""
+    for name, value in session.analytics.memo.stats().items():
+        click.echo(f"{name.replace('_', ' ').capitalize()}: {value}")
+    entries, size = session.db.get_analytics_cache_size()
+    click.echo(f"Persistent cache: {entries} entries, {size} bytes")
+
+
+# Command to list every streak of a habit
+@cli.command()
+@click.argument('habit_id', type=int)
+@click.option('--min-length', type=int, default=None, help="Only list streaks at least this long.")
+@in_unit_of_work
+def streak_history(session, habit_id, min_length):
+    """List every streak of a habit with its first and last day."""
+    habit = session.db.get_habit_by_id(habit_id)
+    if not habit:
+        click.echo(f"No habit found with ID {habit_id}.")
+        return
+    unit = "weeks" if habit[2] == "weekly" else "days"
+    segments = session.analytics.get_streak_segments(habit_id, min_length=min_length)
+    if not segments:
+        click.echo(f"No streaks found for habit with ID {habit_id}.")
+    for first, last, length in segments:
+        click.echo(f"{first} to {last}: {length} {unit}")
+
+
+# Command to show several statistics per habit
+@cli.command()
+@click.argument('habit_id', type=int, required=False)
+@click.option('--metric', 'metrics', multiple=True, type=click.Choice(list(METRICS)),
+              help="Metric to show; repeat for several. Defaults to all of them.")
+@in_unit_of_work
+def stats(session, habit_id, metrics):
+    """Show statistics for every habit, or for one habit, computed in a single pass."""
+    names = {habit[0]: habit[1] for habit in session.db.get_habits()}
+    if habit_id is not None and habit_id not in names:
+        click.echo(f"No habit found with ID {habit_id}.")
+        return
+    all_stats = session.analytics.get_habit_stats(metrics or None, habit_id)
+    for stats_id, values in all_stats.items():
+        click.echo(f"ID: {stats_id}, Name: {names[stats_id]}")
+        for metric, value in values.items():
+            if metric == "completion_rate":
+                value = f"{value:.0%}"
+            click.echo(f"  {metric.replace('_', ' ').capitalize()}: {value if value is not None else '-'}")
+
+
+# Command to aggregate statistics over many database files
+@cli.command()
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help="Worker processes for large fleets. Defaults to the number of CPUs.")
+def fleet(paths, workers):
+    """Show totals over several database files, given as paths or quoted glob patterns."""
+    try:
+        summary = Analytics.fleet_summary(paths, workers)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    by_periodicity = ", ".join(f"{periodicity}: {count}" for periodicity, count in summary["habits_by_periodicity"].items())
+    click.echo(f"{summary['databases']} databases, {summary['habits']} habits ({by_periodicity or 'none'}), "
+               f"{summary['completions']} completions.")
+    if summary["longest_streak_habit"]:
+        path, habit_id, periodicity = summary["longest_streak_habit"]
+        unit = "weeks" if periodicity == "weekly" else "days"
+        click.echo(f"The longest streak across all databases is {summary['longest_streak']} {unit}, "
+                   f"habit with ID {habit_id} in {path}.")
+    else:
+        click.echo("No habit in these databases has been completed yet.")
+
 if __name__ == '__main__':
     cli()
 
-# Close database connections when the script ends
-import atexit
-@atexit.register
-def cleanup():
-    db.close()
-    analytics.close()
-
@@ -0,0 +1,177 @@
+import json
+import time
+from datetime import datetime
+
+from db_manager import BULK_CHUNK_SIZE
+from timestamps import parse_timestamp
+
+# Characters read from the seed file at a time.
+READ_SIZE = 1 << 16
+
+_WHITESPACE = " \t\n\r"
+
+
+class _JsonStream:
+    """
+    A minimal pull parser over a JSON text file.
+
+    It reads the file in fixed-size blocks and keeps only the unparsed tail in memory,
+    so any single value has to fit in memory but the document as a whole does not.
+    """
+
+    def __init__(self, file, read_size=READ_SIZE):
+        self.file = file
+        self.read_size = read_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read_more(self):
+        """Append the next block of the file to the buffer, dropping what was consumed."""
+        if self.eof:
+            return False
+        block = self.file.read(self.read_size)
+        if not block:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it, or '' at the end."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read_more():
+                return ""
+
+    def expect(self, char):
+        """Consume the next non-whitespace character, which must be `char`."""
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid seed file: expected '{char}' but found '{found or 'end of file'}'.")
+        self.pos += 1
+
+    def value(self):
+        """Decode and consume the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._read_more():
+                    continue
+                raise
+            # A number or literal at the end of the buffer may continue in the next block
+            if end == len(self.buffer) and self._read_more():
+                continue
+            self.pos = end
+            return value
+
+    def items(self, open_char, close_char):
+        """
+        Iterate over the members of an array or object.
+
+        Yields once per member with the stream positioned at the member, which the
+        caller must consume before asking for the next one.
+        """
+        self.expect(open_char)
+        if self.peek() == close_char:
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect(close_char)
+                return
+
+    def keys(self):
+        """Iterate over the keys of an object; the caller consumes each value."""
+        for _ in self.items("{", "}"):
+            key = self.value()
+            self.expect(":")
+            yield key
+
+
+def _parse_completion(completion_datetime_str, now):
+    """Parse a seed file timestamp and reject dates in the future, like HabitManager does."""
+    completion_datetime = parse_timestamp(completion_datetime_str)
+    if completion_datetime > now:
+        raise ValueError("Completion date cannot be in the future.")
+    return completion_datetime
+
+
+def iter_seed_habits(file, read_size=READ_SIZE):
+    """
+    Incrementally parse a habit_data.json-shaped file.
+
+    Yields (name, periodicity, completions) for every habit, where completions is an
+    iterator of datetimes read straight from the file. It must be consumed before the
+    next habit is requested (anything left over is skipped). Completions are only held
+    in memory when a habit lists them before its name and periodicity.
+
+    Args:
+        file: A text file object positioned at the start of the document.
+        read_size (int, optional): Characters read from the file at a time.
+    """
+    stream = _JsonStream(file, read_size)
+    now = datetime.now()
+    for key in stream.keys():
+        if key != "habits":
+            stream.value()
+            continue
+        for _ in stream.items("[", "]"):
+            name = periodicity = None
+            buffered = None
+            emitted = False
+            for field in stream.keys():
+                if field == "name":
+                    name = stream.value()
+                elif field == "periodicity":
+                    periodicity = stream.value()
+                elif field == "completion_datetime" and name and periodicity and not emitted:
+                    completions = (_parse_completion(stream.value(), now) for _ in stream.items("[", "]"))
+                    yield name, periodicity, completions
+                    emitted = True
+                    for _ in completions:
+                        pass  # Skip whatever the consumer left unread
+                elif field == "completion_datetime":
+                    buffered = [_parse_completion(stream.value(), now) for _ in stream.items("[", "]")]
+                else:
+                    stream.value()
+            if not emitted:
+                yield name, periodicity, iter(buffered or [])
+
+
+def load_seed_file(db, path, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Replace every habit in the database with the habits of a seed file.
+
+    The whole load is one transaction, so a malformed file leaves the existing habits untouched.
+
+    Args:
+        db (HabitDatabase): The database to load into.
+        path (str): Path of a habit_data.json-shaped file.
+        chunk_size (int, optional): Completions per executemany call.
+
+    Returns:
+        tuple: (habits loaded, completions loaded, elapsed seconds).
+    """
+    start = time.perf_counter()
+
+    def validated(habits):
+        # Duplicate names are rejected by the unique name index
+        for name, periodicity, completions in habits:
+            if not name or not periodicity:
+                raise ValueError("Name and periodicity are required to create a habit.")
+            yield name, periodicity, completions
+
+    with open(path, "r") as f:
+        habit_count, completion_count = db.replace_all_habits(validated(iter_seed_habits(f)), chunk_size)
+    return habit_count, completion_count, time.perf_counter() - start
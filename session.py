@@ -0,0 +1,46 @@
+from db_manager import HabitDatabase
+from habit_manager import HabitManager
+from analytics import Analytics
+from lru import LRUCache, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_BYTES
+
+
+class HabitSession:
+    """
+    One database connection shared by a HabitManager and an Analytics instance.
+
+    Everything done through a session runs on the same connection, so a unit of work
+    that creates, completes and analyzes habits sees its own writes and holds a single
+    writer lock. Pass ":memory:" as db_name for a throwaway database.
+    """
+
+    def __init__(self, db_name="habits.db", migrate=True, profile=None,
+                 cache_entries=DEFAULT_MAX_ENTRIES, cache_bytes=DEFAULT_MAX_BYTES):
+        """
+        Open the session's connection.
+
+        Args:
+            db_name (str, optional): Database file path, or ":memory:". Defaults to "habits.db".
+            migrate (bool, optional): Apply pending schema migrations on open. Defaults to True.
+            profile (str, optional): Performance profile; see db_manager.resolve_profile.
+            cache_entries (int, optional): Most entries in the in-process analytics cache.
+            cache_bytes (int, optional): Most approximate bytes in the in-process analytics cache.
+        """
+        self.db = HabitDatabase(db_name, migrate=migrate, profile=profile)
+        self.habit_manager = HabitManager(self.db)
+        self.analytics = Analytics(self.db, memo=LRUCache(cache_entries, cache_bytes))
+        # Writes made through the manager drop the analytics cached for those habits
+        self.habit_manager.add_write_listener(self.analytics.invalidate)
+
+    def unit_of_work(self):
+        """Return a context manager running its block as one transaction on the session's connection."""
+        return self.db.transaction()
+
+    def close(self):
+        """Close the session's connection."""
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,8 +1,19 @@
 import pytest
-from db_manager import HabitDatabase
+from db_manager import HabitDatabase, SCHEMA_VERSION, copy_in_batches, encode_completion, resolve_profile
 from habit_manager import HabitManager
 from datetime import datetime
-from analytics import Analytics
+from analytics import Analytics, habit_id_ranges, longest_run_vectorized
+from bitmaps import DayBitmap
+from timestamps import TIMESTAMP_FORMAT, parse_day_ordinal, parse_timestamp
+from seeder import iter_seed_habits, load_seed_file
+from session import HabitSession
+from lru import LRUCache, approximate_size
+from async_db import AsyncHabitDatabase, READ_METHODS, WRITE_METHODS
+import asyncio
+import json
+import db_manager
+import random
+from datetime import timedelta
 
 @pytest.fixture(scope="function")
 
@@ -10,18 +21,16 @@ def clean_db():
     """
     Pytest fixture to provide a clean database for each test function.
 
-    - Initializes a HabitDatabase instance connected to "habits.db".
-    - Deletes all existing habits before the test to ensure a clean state.
-    - Yields the database instance for use in the test.
-    - Cleans up by deleting all habits again and closing the database after the test.
+    - Initializes a HabitDatabase instance connected to a new in-memory database.
+    - Yields the database instance for use in the test; HabitManager and Analytics
+      instances share it instead of opening their own connection.
+    - Closes the database after the test, which discards it.
 
     This ensures that each test starts with a fresh database environment, preventing
-    interference between test cases.
+    interference between test cases, and never touches "habits.db".
     """
-    db = HabitDatabase("habits.db")
-    db.delete_all_habits() 
+    db = HabitDatabase(":memory:")
     yield db 
-    db.delete_all_habits()
     db.close() 
 
 # TESTS FOR HABIT MANAGER
@@ -39,7 +48,7 @@ def test_create_habit_with_valid_name_and_periodicity(clean_db):
     """
     habit_name = "Exercise"
     periodicity = "daily"
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     habit_manager.create_habit(habit_name, periodicity)
 
@@ -63,7 +72,7 @@ def test_create_habit_with_empty_name(clean_db):
     """
     habit_name = ""
     periodicity = "daily"
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     with pytest.raises(ValueError, match="Name and periodicity are required to create a habit."):
         habit_manager.create_habit(habit_name, periodicity)
@@ -81,7 +90,7 @@ def test_create_habit_with_empty_periodicity (clean_db):
     """
     habit_name = "Drink 2 liter water"
     periodicity = ""
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     with pytest.raises(ValueError, match="Name and periodicity are required to create a habit."):
         habit_manager.create_habit(habit_name, periodicity)
@@ -99,7 +108,7 @@ def test_create_habit_with_empty_name_andempty_periodicity(clean_db):
     """
     habit_name = ""
     periodicity = ""
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     with pytest.raises(ValueError, match="Name and periodicity are required to create a habit."):
         habit_manager.create_habit(habit_name, periodicity)
@@ -111,7 +120,7 @@ def test_create_habit_with_duplicate_name(clean_db):
     """
     habit_name = "Yoga"
     periodicity = "weekly"
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     habit_manager.create_habit(habit_name, periodicity)  # Create the first habit
 
@@ -141,7 +150,7 @@ def test_delete_habit_with_valid_id(clean_db):
 def test_delete_habit_with_invalid_id(clean_db):
     """Test attempting to delete a habit that does not exist."""
     habit_id = 9999  # ID que no existe en la base de datos
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     # Ensure the database has at least one habit to avoid triggering the 
     # "No habits found in the database." condition
@@ -159,7 +168,7 @@ def test_delete_habit_when_no_habits_exist(clean_db):
     Test that deleting a habit when no habits exist in the database raises a ValueError.
 
     """
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     # Attempt to delete a habit when there are no habits stored
     with pytest.raises(ValueError, match="No habits found in the database."):
@@ -171,7 +180,7 @@ def test_mark_habit_completed_without_id(clean_db):
     Test para marcar un hábito como completado sin proporcionar un ID válido.
     Esto verifica que se lance un ValueError cuando no se proporciona un ID de hábito.
     """
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     # Intentamos marcar el hábito como completado sin pasar un ID
     completion_time = datetime(2025, 2, 12, 7, 30, 0)  # Hora de finalización
@@ -186,7 +195,7 @@ def test_mark_habit_completed_with_invalid_id(clean_db):
     Test to mark a habit as completed with an invalid ID.
     This checks that a ValueError is raised when the habit ID does not exist in the database.
     """
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     # Using an invalid ID that does not exist in the database
     invalid_id = 9999  # Assuming 9999 is not a valid ID
@@ -204,7 +213,7 @@ def test_mark_habit_completed_with_invalid_id(clean_db):
 #11 Get the list of the habits when there are no habits
 def test_get_habits_when_there_are_no_habits(clean_db):
     """Verifies that an empty list is returned when there are no habits in the database."""
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
     
     # Retrieve the habits, it should be empty
     habits = clean_db.get_habits()
@@ -215,7 +224,7 @@ def test_get_habits_when_there_are_no_habits(clean_db):
 #12 Get the list of habits when there are habits
 def test_get_habits_when_there_are_habits(clean_db):
     """Verifies that the habits are returned when there are habits in the database."""
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
     
      # Create some habits
     habit_manager.create_habit("Exercise", "daily")
@@ -236,7 +245,7 @@ def test_get_habits_when_there_are_habits(clean_db):
 #13 Get the list of habits of a given periodicity
 def test_get_habits_by_periodicity(clean_db):
     """Verify that habits are returned with a specific periodicity."""
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
     
     # Create some habits with different periodicities
     habit_manager.create_habit("Exercise", "daily")
@@ -279,7 +288,7 @@ def test_get_longest_streak_empty_db(clean_db):
 def test_calculate_streak_with_gaps():
     """Test with 5 dates containing gaps; the longest streak should be 3"""
     
-    analytics = Analytics()
+    analytics = Analytics(db=HabitDatabase(":memory:"))
 
     # Example dates with gaps 
     dates = [
@@ -305,7 +314,7 @@ def test_calculate_streak_with_gaps():
 def test_calculate_streak_weekly():
     """Test the weekly streak calculation with consecutive dates in different weeks."""
     
-    analytics = Analytics()
+    analytics = Analytics(db=HabitDatabase(":memory:"))
 
     # Completion dates in consecutive weeks
     dates = [
@@ -326,7 +335,7 @@ def test_calculate_streak_weekly():
 def test_get_longest_streak_for_habit(clean_db):
     """Verify that the function correctly returns the longest streak for a habit."""
     analytics = Analytics(db=clean_db)
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     # Creating a new habit
     habit_manager.create_habit("Meditation", "daily")
@@ -360,7 +369,7 @@ def test_get_longest_streak_for_habit(clean_db):
 def test_get_longest_streak_for_habit_weekly(clean_db):
     """Verify that the function correctly returns the longest streak for a weekly habit with different days of the week."""
     analytics = Analytics(db=clean_db)
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     # Create a new habit on a weekly basis
     habit_manager.create_habit("Read a book", "weekly")
@@ -393,7 +402,7 @@ def test_get_longest_streak_for_habit_weekly(clean_db):
 def test_get_longest_streak(clean_db):
     """Verify that the function returns the longest streak among all stored habits."""
     analytics = Analytics(db=clean_db)
-    habit_manager = HabitManager()
+    habit_manager = HabitManager(clean_db)
 
     # Create several habits with different periodicities
     habit_manager.create_habit("Morning Run", "daily")
@@ -454,3 +463,799 @@ def test_get_longest_streak(clean_db):
 
 
 
+
+
+#20 Completion dates come back in chronological order, read from the composite index
+def test_get_completion_dates_ordered_from_index(clean_db):
+    """Verify that completion dates are returned oldest first using the covering (habit_id, completion_epoch) index."""
+    clean_db.insert_habit("Stretching", "daily")
+    habit_id = clean_db.get_habits()[0][0]
+
+    for date in ["2025-02-03 08:00:00", "2025-02-01 08:00:00", "2025-02-02 08:00:00"]:
+        clean_db.insert_completion_datetime(habit_id, date)
+
+    dates = [row[0] for row in clean_db.get_completion_dates(habit_id)]
+    assert dates == ["2025-02-01 08:00:00", "2025-02-02 08:00:00", "2025-02-03 08:00:00"]
+
+    plan = clean_db.conn.execute("""
+    EXPLAIN QUERY PLAN SELECT day_ordinal FROM completion_dates
+    WHERE habit_id = ? ORDER BY completion_epoch
+    """, (habit_id,)).fetchall()
+    details = " ".join(row[-1] for row in plan)
+    assert "COVERING INDEX idx_completion_dates_habit_epoch" in details
+    assert "TEMP B-TREE" not in details  # No separate sort step
+    assert clean_db.get_schema_version() == SCHEMA_VERSION
+
+
+#21 Pending migrations are applied in order and only once
+def test_migrate_applies_pending_steps_once(tmp_path):
+    """Verify that migrate() brings a new database to SCHEMA_VERSION and is a no-op afterwards."""
+    db = HabitDatabase(str(tmp_path / "old.db"), migrate=False)
+    assert db.get_schema_version() == 0
+    assert db.get_pending_migrations()
+
+    steps = []
+    applied = db.migrate(on_step=lambda version, description, seconds: steps.append(version))
+
+    assert [step[0] for step in applied] == steps == sorted(steps)
+    assert db.get_schema_version() == SCHEMA_VERSION
+    assert db.migrate() == []  # Nothing left to apply
+    db.close()
+
+#22 Migration data copies run in bounded batches
+def test_copy_in_batches(clean_db):
+    """Verify that copy_in_batches copies and transforms every row using small batches."""
+    conn = clean_db.conn
+    conn.execute("CREATE TEMP TABLE source (value INTEGER)")
+    conn.execute("CREATE TEMP TABLE target (value INTEGER)")
+    conn.executemany("INSERT INTO source VALUES (?)", [(i,) for i in range(25)])
+
+    copied = copy_in_batches(conn, "SELECT value FROM source ORDER BY value",
+                             "INSERT INTO target VALUES (?)",
+                             transform=lambda row: (row[0] * 2,), batch_size=4)
+
+    assert copied == 25
+    assert [row[0] for row in conn.execute("SELECT value FROM target ORDER BY value")] == [i * 2 for i in range(25)]
+
+#23 TEXT completion timestamps are migrated to integer epoch, day and week ordinals
+def test_migrate_text_completions_to_integers(tmp_path):
+    """Verify that completions stored as TEXT by older versions are converted without losing data."""
+    db = HabitDatabase(str(tmp_path / "old.db"), migrate=False)
+    db.conn.execute("INSERT INTO habits (name, periodicity, creation_date) VALUES ('Walk', 'weekly', '2025-01-01')")
+    db.conn.executemany(
+        "INSERT INTO completion_dates (habit_id, completion_datetime) VALUES (1, ?)",
+        [("2025-01-06 09:00:00",), ("2024-12-31 23:59:59",), ("2025-01-13 07:15:30.250000",)])
+    db.conn.commit()
+
+    db.migrate()
+
+    assert db.get_completion_dates(1) == [
+        ("2024-12-31 23:59:59",), ("2025-01-06 09:00:00",), ("2025-01-13 07:15:30",)]
+    epoch, day, week = encode_completion("2025-01-06 09:00:00")
+    assert day == datetime(2025, 1, 6).toordinal()
+    assert epoch == 1736154000  # Wall-clock seconds since 1970-01-01 00:00:00, no timezone shift
+    # 2024-12-31 (Tuesday) and 2025-01-06 (Monday) fall in consecutive ISO weeks
+    assert db.get_completion_periods(1, "weekly") == [week - 1, week, week + 1]
+    assert db.get_streak_state(1) == (week + 1, 3, 3)  # Backfilled by the streak state migration
+    assert Analytics(db=db).get_longest_streak_for_habit(1, engine="bitmap") == 3  # Backfilled bitmap
+    db.close()
+
+#24 Bulk completion insert streams the input in committed chunks
+def test_mark_habits_completed_bulk(clean_db):
+    """Verify that bulk completions are all recorded, and that an unknown ID stops the import."""
+    habit_manager = HabitManager(clean_db)
+    habit_manager.create_habit("Journal", "daily")
+    habit_id = clean_db.get_habits()[0][0]
+
+    completions = ((habit_id, datetime(2025, 1, day, 21, 0, 0)) for day in range(1, 11))
+    assert habit_manager.mark_habits_completed_bulk(completions, chunk_size=3) == 10
+    assert len(clean_db.get_completion_dates(habit_id)) == 10
+    assert Analytics(db=clean_db).get_longest_streak_for_habit(habit_id) == 10
+
+    invalid = [(habit_id, datetime(2025, 2, 1, 8, 0, 0)), (9999, datetime(2025, 2, 2, 8, 0, 0))]
+    with pytest.raises(ValueError, match="No habit found with ID 9999."):
+        habit_manager.mark_habits_completed_bulk(invalid, chunk_size=10)
+    assert len(clean_db.get_completion_dates(habit_id)) == 10  # The failing chunk was not written
+
+#25 The seed file is parsed incrementally, whatever the key order
+def test_iter_seed_habits_streams_file(tmp_path):
+    """Verify that the incremental parser returns the same habits as json.load, even with tiny read blocks."""
+    path = tmp_path / "seed.json"
+    path.write_text(json.dumps({
+        "version": 1,
+        "habits": [
+            {"name": "Read", "periodicity": "daily",
+             "completion_datetime": ["2025-01-01 08:00:00", "2025-01-02 08:00:00"]},
+            {"completion_datetime": ["2025-01-06 09:00:00"], "periodicity": "weekly", "name": "Swim"},
+            {"name": "Paint", "periodicity": "weekly", "completion_datetime": [], "tags": [1, 2.5, None]},
+        ],
+    }, indent=2))
+
+    with open(path) as f:
+        habits = [(name, periodicity, list(completions))
+                  for name, periodicity, completions in iter_seed_habits(f, read_size=7)]
+
+    assert habits == [
+        ("Read", "daily", [datetime(2025, 1, 1, 8), datetime(2025, 1, 2, 8)]),
+        ("Swim", "weekly", [datetime(2025, 1, 6, 9)]),
+        ("Paint", "weekly", []),
+    ]
+
+#26 Loading a seed file replaces all habits in one transaction
+def test_load_seed_file(clean_db, tmp_path):
+    """Verify that the predefined habits are loaded, and that an invalid file leaves the database untouched."""
+    habit_count, completion_count, _ = load_seed_file(clean_db, "habit_data.json")
+
+    with open("habit_data.json") as f:
+        expected = json.load(f)["habits"]
+    assert habit_count == len(expected) == len(clean_db.get_habits())
+    assert completion_count == sum(len(habit["completion_datetime"]) for habit in expected)
+
+    path = tmp_path / "duplicate.json"
+    path.write_text(json.dumps({"habits": [
+        {"name": "Yoga", "periodicity": "daily", "completion_datetime": []},
+        {"name": "yoga", "periodicity": "daily", "completion_datetime": []},
+    ]}))
+    with pytest.raises(ValueError, match="The habit 'yoga' already exists."):
+        load_seed_file(clean_db, str(path))
+    assert len(clean_db.get_habits()) == habit_count  # Rolled back
+
+#27 Duplicate names are rejected by the unique index, ignoring case
+def test_create_habit_with_duplicate_name_different_case(clean_db):
+    """Verify that the NOCASE unique index rejects a name that differs only by case."""
+    habit_manager = HabitManager(clean_db)
+    habit_manager.create_habit("Yoga", "weekly")
+
+    with pytest.raises(ValueError, match="The habit 'YOGA' already exists."):
+        habit_manager.create_habit("YOGA", "daily")
+    assert len(clean_db.get_habits()) == 1
+
+    plan = clean_db.conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id FROM habits WHERE name = ? COLLATE NOCASE", ("yoga",)).fetchall()
+    assert "idx_habits_name_nocase" in " ".join(row[-1] for row in plan)
+
+#28 Existing names that only differ by case are renamed by the migration
+def test_migrate_renames_case_duplicates(tmp_path):
+    """Verify that the unique name migration keeps the first habit and suffixes later duplicates with their ID."""
+    db = HabitDatabase(str(tmp_path / "old.db"), migrate=False)
+    db.conn.executemany("INSERT INTO habits (name, periodicity, creation_date) VALUES (?, 'daily', '2025-01-01')",
+                        [("Run",), ("run",), ("Swim",)])
+    db.conn.commit()
+
+    db.migrate()
+
+    assert [habit[1] for habit in db.get_habits()] == ["Run", "run (2)", "Swim"]
+    db.close()
+
+    # The suffixed name is already taken, even with another case
+    db = HabitDatabase(str(tmp_path / "taken.db"), migrate=False)
+    db.conn.executemany("INSERT INTO habits (name, periodicity, creation_date) VALUES (?, 'daily', '2025-01-01')",
+                        [("Run",), ("run",), ("RUN (2)",), ("run (2-2)",)])
+    db.conn.commit()
+
+    db.migrate()
+
+    assert db.get_schema_version() == SCHEMA_VERSION
+    assert [habit[1] for habit in db.get_habits()] == ["Run", "run (2-3)", "RUN (2)", "run (2-2)"]
+    db.close()
+
+#29 A session shares one connection and commits each unit of work once
+def test_session_unit_of_work(tmp_path):
+    """Verify that HabitManager and Analytics share the session connection and that units of work commit or roll back as a whole."""
+    path = str(tmp_path / "session.db")
+    with HabitSession(path) as session:
+        assert session.habit_manager.db is session.analytics.db is session.db
+
+        with session.unit_of_work():
+            session.habit_manager.create_habit("Plank", "daily")
+            habit_id = session.db.get_habits()[0][0]
+            session.habit_manager.mark_habit_completed(habit_id, datetime(2025, 3, 1, 7, 0, 0))
+            # A failed nested write is undone without losing the rest of the unit of work
+            with pytest.raises(ValueError):
+                session.habit_manager.create_habit("plank", "daily")
+            assert session.analytics.get_longest_streak_for_habit(habit_id) == 1
+
+        with pytest.raises(RuntimeError):
+            with session.unit_of_work():
+                session.habit_manager.create_habit("Squats", "daily")
+                raise RuntimeError("abort")
+
+    with HabitSession(path) as session:
+        assert [habit[1] for habit in session.db.get_habits()] == ["Plank"]
+        assert session.db.get_completion_dates(habit_id) == [("2025-03-01 07:00:00",)]
+
+#30 Performance profiles come from the argument, the environment or the config file
+def test_resolve_profile(tmp_path, monkeypatch):
+    """Verify the precedence of performance profile sources and config PRAGMA overrides."""
+    monkeypatch.delenv("HABIT_TRACKER_PROFILE", raising=False)
+    config = tmp_path / "habit_tracker.json"
+    config.write_text(json.dumps({"profile": "balanced", "pragmas": {"cache_size": -32000}}))
+
+    assert resolve_profile(config_path=str(tmp_path / "missing.json"))[0] == "durable"
+    name, pragmas = resolve_profile(config_path=str(config))
+    assert name == "balanced"
+    assert pragmas["journal_mode"] == "WAL" and pragmas["cache_size"] == -32000
+
+    monkeypatch.setenv("HABIT_TRACKER_PROFILE", "throughput")
+    assert resolve_profile(config_path=str(config))[0] == "throughput"
+    assert resolve_profile("durable", config_path=str(config))[0] == "durable"
+    with pytest.raises(ValueError, match="Unknown performance profile 'fast'"):
+        resolve_profile("fast")
+    assert "journal_mode" not in resolve_profile("durable", config_path=None)[1]
+    config.write_text(json.dumps({"pragmas": {"journal_mode": "DELETE"}}))
+    with pytest.raises(ValueError, match="only be set to WAL"):
+        resolve_profile(config_path=str(config))
+
+#31 With WAL, readers are not blocked by an open write transaction
+def test_balanced_profile_reads_during_write(tmp_path):
+    """Verify that the balanced profile enables WAL and a second connection can read while a write is pending."""
+    path = str(tmp_path / "wal.db")
+    writer = HabitDatabase(path, profile="balanced")
+    reader = HabitDatabase(path, profile="balanced")
+    assert writer.get_settings()["journal_mode"] == "wal"
+    assert writer.get_settings()["synchronous"] == "NORMAL"
+
+    writer.insert_habit("Cycling", "daily")
+    with writer.transaction():
+        writer.insert_habit("Rowing", "daily")
+        assert [habit[1] for habit in reader.get_habits()] == ["Cycling"]  # Committed snapshot
+    assert len(reader.get_habits()) == 2
+
+    # A default-profile connection next to a live WAL connection leaves the file in WAL
+    default = HabitDatabase(path)
+    assert default.get_settings()["journal_mode"] == "wal"
+    default.insert_habit("Swimming", "weekly")
+    assert len(reader.get_habits()) == 3
+    default.close()
+    writer.close()
+    reader.close()
+    assert HabitDatabase(path).get_settings()["journal_mode"] == "wal"
+
+#32 The SQL gaps-and-islands engine agrees with _calculate_streak
+def test_sql_streak_engine_matches_calculate_streak(clean_db):
+    """Cross-check the single-query streak engine against _calculate_streak on random histories."""
+    analytics = Analytics(db=clean_db)
+    rng = random.Random(42)
+    start = datetime(2024, 6, 1, 6, 0, 0)
+
+    for index in range(12):
+        habit_id = clean_db.insert_habit(f"Habit {index}", "weekly" if index % 3 == 0 else "daily")
+        for _ in range(rng.randint(0, 80)):
+            offset = timedelta(days=rng.randint(0, 360), hours=rng.randint(0, 17))
+            clean_db.insert_completion_datetime(habit_id, start + offset)
+
+    expected = {habit[0]: analytics._calculate_streak(clean_db.get_completion_dates(habit[0]), habit[2])
+                for habit in clean_db.get_habits()}
+
+    assert analytics.get_longest_streaks(engine="sql") == expected
+    assert analytics.get_longest_streaks(engine="python") == expected
+    assert analytics.get_longest_streaks(engine="array") == expected
+    assert analytics.get_longest_streaks(engine="state") == expected  # Maintained incrementally, out of order
+    assert analytics.get_longest_streaks(engine="bitmap") == expected
+    assert analytics.get_longest_streaks(engine="stream") == expected
+    assert analytics.get_longest_streak(engine="sql") == max(expected.values())
+    for habit_id, streak in expected.items():
+        assert analytics.get_longest_streak_for_habit(habit_id, engine="sql") == streak
+    assert analytics.get_longest_streak_for_habit(9999, engine="sql") == 0
+
+#33 Streak state is updated in O(1) for in-order completions and merged for back-dated ones
+def test_streak_state_incremental_updates(clean_db, monkeypatch):
+    """Verify that habit_streak_state follows inserts, merging back-dated completions into the stored segments."""
+    analytics = Analytics(db=clean_db)
+    habit_id = clean_db.insert_habit("Piano", "daily")
+    merges = []
+    merge = db_manager._merge_streaks
+    monkeypatch.setattr(db_manager, "_merge_streaks",
+                        lambda conn, periods, last: merges.append(set(periods)) or merge(conn, periods, last))
+
+    for date in ["2025-03-01 08:00:00", "2025-03-02 08:00:00", "2025-03-02 20:00:00",
+                 "2025-03-05 08:00:00", "2025-03-06 08:00:00"]:
+        clean_db.insert_completion_datetime(habit_id, date)
+    assert merges == []
+    march_6 = datetime(2025, 3, 6).toordinal()
+    assert clean_db.get_streak_state(habit_id) == (march_6, 2, 2)
+
+    # Filling the gap joins both runs into one streak of 6 days
+    clean_db.insert_completion_datetime(habit_id, "2025-03-03 08:00:00")
+    clean_db.insert_completion_datetime(habit_id, "2025-03-04 08:00:00")
+    assert merges == [{habit_id}, {habit_id}]
+    assert clean_db.get_streak_state(habit_id) == (march_6, 6, 6)
+    assert analytics.get_longest_streak() == analytics.get_longest_streak_for_habit(habit_id) == 6
+
+    clean_db.delete_habit(habit_id)
+    assert clean_db.get_streak_state(habit_id) is None
+    assert analytics.get_longest_streak() == 0
+
+#34 The array engine agrees with the plain loop, with or without NumPy
+def test_longest_run_engines_agree():
+    """Verify run detection on ascending ordinals with repeats, and that NumPy, when installed, gives the same answer."""
+    cases = [[], [7], [1, 3, 4, 4, 5, 10, 11, 12, 13, 13], list(range(1000))]
+    assert [Analytics._longest_run(periods) for periods in cases] == [0, 1, 4, 1000]
+    if longest_run_vectorized is not None:
+        assert [longest_run_vectorized(periods) for periods in cases] == [0, 1, 4, 1000]
+
+#35 Day bitmaps answer streak, count and overlap questions
+def test_day_bitmap_queries(clean_db):
+    """Verify current streaks, popcounts and habits completed together from the maintained bitmaps."""
+    analytics = Analytics(db=clean_db)
+    run = clean_db.insert_habit("Run", "daily")
+    read = clean_db.insert_habit("Read", "daily")
+    for day in [1, 2, 3, 5, 6]:
+        clean_db.insert_completion_datetime(run, datetime(2025, 3, day, 7, 0, 0))
+    for day in [2, 3, 4, 6]:
+        clean_db.insert_completion_datetime(read, datetime(2025, 3, day, 21, 0, 0))
+    clean_db.insert_completion_datetime(run, "2025-02-20 07:00:00")  # Before the bitmap origin
+
+    assert analytics.get_current_streak(run, as_of=datetime(2025, 3, 6).date()) == 2
+    assert analytics.get_current_streak(run, as_of=datetime(2025, 3, 7).date()) == 2  # Not done yet today
+    assert analytics.get_current_streak(run, as_of=datetime(2025, 3, 8).date()) == 0
+    assert analytics.count_completed_days(run) == 6
+    assert analytics.count_completed_days(run, datetime(2025, 3, 2).date(), datetime(2025, 3, 5).date()) == 3
+    assert analytics.get_completion_rate(read, datetime(2025, 3, 1).date(), datetime(2025, 3, 8).date()) == 0.5
+    assert analytics.get_days_completed_together([run, read]) == [
+        datetime(2025, 3, day).date() for day in [2, 3, 6]]
+    assert analytics.get_days_completed_together([run, 9999]) == []
+
+    clean_db.delete_habit(run)
+    assert clean_db.get_day_bitmaps([run]) == {}
+
+#36 A day bitmap folds into ISO weeks across year boundaries
+def test_day_bitmap_weeks():
+    """Verify weekly runs over 2020-W53 and that bitmaps grow backwards from a Monday origin."""
+    bitmap = DayBitmap(datetime(2021, 1, 6).toordinal())
+    for day in [datetime(2021, 1, 4), datetime(2020, 12, 31), datetime(2020, 12, 21)]:
+        bitmap.add(day.toordinal())
+    assert bitmap.origin == datetime(2020, 12, 21).toordinal()
+    assert bitmap.longest_run("weekly") == 3
+    assert bitmap.longest_run("daily") == 1
+    assert list(bitmap.days()) == [datetime(2020, 12, 21).toordinal(), datetime(2020, 12, 31).toordinal(),
+                                   datetime(2021, 1, 4).toordinal()]
+    assert datetime(2020, 12, 31).toordinal() in bitmap
+
+#37 The fast timestamp parser accepts and rejects exactly what strptime does
+def test_parse_timestamp_matches_strptime():
+    """Compare parse_timestamp with datetime.strptime on valid, unusual and invalid strings."""
+    for text in ["2025-03-06 07:15:30", "2024-02-29 23:59:59", "2025-3-6 7:15:30"]:
+        assert parse_timestamp(text) == datetime.strptime(text, TIMESTAMP_FORMAT)
+    assert parse_day_ordinal("2025-03-06 07:15:30") == datetime(2025, 3, 6).toordinal()
+
+    for text in ["2025-02-30 10:00:00", "2025-03-06T07:15:30", "2025-03-06 24:00:00",
+                 "2025-03-06", "2025-03-06 07:15:30.5", "06/03/2025 07:15:30", ""]:
+        with pytest.raises(ValueError) as expected:
+            datetime.strptime(text, TIMESTAMP_FORMAT)
+        with pytest.raises(ValueError) as raised:
+            parse_timestamp(text)
+        assert str(raised.value) == str(expected.value)
+
+#38 Weekly streaks continue across ISO years with 53 weeks
+def test_calculate_streak_across_53_week_year(clean_db):
+    """2020 has an ISO week 53, so 2020-W52, 2020-W53 and 2021-W01 are three consecutive weeks."""
+    analytics = Analytics(db=clean_db)
+    weekly = [("2020-12-21 08:00:00",), ("2020-12-28 08:00:00",), ("2021-01-04 08:00:00",)]
+    assert analytics._calculate_streak(weekly, "weekly") == 3
+    assert analytics._calculate_streak(weekly[::-1], "weekly") == 3
+
+    # Completing twice on the same day does not break a daily streak
+    daily = [("2021-01-01 08:00:00",), ("2021-01-02 08:00:00",), ("2021-01-02 20:00:00",), ("2021-01-03 08:00:00",)]
+    assert analytics._calculate_streak(daily, "daily") == 3
+    assert analytics._calculate_streak([], "daily") == 0
+
+#39 The stream engine reads every habit with one query
+def test_stream_engine_single_query(clean_db):
+    """Verify that the stream engine issues one SELECT whatever the number of habits."""
+    analytics = Analytics(db=clean_db, cache=False)
+    for index in range(20):
+        habit_id = clean_db.insert_habit(f"Habit {index}", "daily")
+        for day in range(index % 5):
+            clean_db.insert_completion_datetime(habit_id, datetime(2025, 1, 1 + day, 8, 0, 0))
+    clean_db.insert_habit("Never done", "weekly")
+
+    statements = []
+    clean_db.conn.set_trace_callback(statements.append)
+    streaks = analytics.get_longest_streaks(engine="stream")
+    clean_db.conn.set_trace_callback(None)
+
+    assert len(statements) == 1
+    assert streaks == analytics.get_longest_streaks(engine="sql")
+    assert streaks[21] == 0
+    assert analytics.get_longest_streak_for_habit(5, engine="stream") == 4
+    assert len(list(clean_db.iter_completions(batch_size=3))) == sum(max(index % 5, 1) for index in range(20)) + 1
+
+#40 Several metrics share one pass over the completions
+def test_habit_stats_single_pass(clean_db):
+    """Verify the reducer metrics on a small history and that they are computed with one query."""
+    analytics = Analytics(db=clean_db)
+    habit_id = clean_db.insert_habit("Stretch", "daily")
+    for day in [3, 4, 4, 5, 8, 10, 11]:  # 2025-03-03 is a Monday
+        clean_db.insert_completion_datetime(habit_id, datetime(2025, 3, day, 7, 0, 0))
+    idle_id = clean_db.insert_habit("Swim", "weekly")
+
+    statements = []
+    clean_db.conn.set_trace_callback(statements.append)
+    stats = analytics.get_habit_stats(as_of=datetime(2025, 3, 12).date())
+    clean_db.conn.set_trace_callback(None)
+
+    assert len(statements) == 1
+    assert stats[habit_id] == {
+        "longest_streak": 3, "current_streak": 2, "total_completions": 7,
+        "first_completion": datetime(2025, 3, 3).date(), "last_completion": datetime(2025, 3, 11).date(),
+        "completion_rate": 0.6, "best_weekday": "Tuesday"}
+    assert stats[idle_id]["total_completions"] == 0 and stats[idle_id]["best_weekday"] is None
+    assert analytics.get_habit_stats(["current_streak"], habit_id, as_of=datetime(2025, 3, 14).date()) == {
+        habit_id: {"current_streak": 0}}
+    with pytest.raises(ValueError, match="Unknown metric 'fastest'"):
+        analytics.get_habit_stats(["fastest"])
+
+    # Completions after as_of are left out, as in get_current_streak
+    later_id = clean_db.insert_habit("Plank", "daily")
+    for day in range(1, 11):
+        clean_db.insert_completion_datetime(later_id, datetime(2025, 1, day, 7, 0, 0))
+    january_5 = datetime(2025, 1, 5).date()
+    assert analytics.get_habit_stats(habit_id=later_id, as_of=january_5)[later_id] == {
+        "longest_streak": 5, "current_streak": 5, "total_completions": 5,
+        "first_completion": datetime(2025, 1, 1).date(), "last_completion": january_5,
+        "completion_rate": 1.0, "best_weekday": "Wednesday"}
+    assert analytics.get_current_streak(later_id, as_of=january_5) == 5
+
+#41 Due and at-risk habits come from the streak state
+def test_due_and_at_risk_habits(clean_db):
+    """Verify current streaks and the due/at-risk lists as the days go by."""
+    analytics = Analytics(db=clean_db)
+    walk = clean_db.insert_habit("Walk", "daily")
+    gym = clean_db.insert_habit("Gym", "weekly")
+    journal = clean_db.insert_habit("Journal", "daily")
+    for day in [2, 3, 4]:
+        clean_db.insert_completion_datetime(walk, datetime(2025, 6, day, 7, 0, 0))
+    clean_db.insert_completion_datetime(walk, datetime(2025, 6, 4, 21, 30, 0))
+    clean_db.insert_completion_datetime(gym, datetime(2025, 5, 28, 18, 0, 0))  # The week before 2025-06-02
+
+    june = lambda day: datetime(2025, 6, day).date()
+    assert clean_db.get_due_habits(june(4).toordinal()) == [
+        (gym, "Gym", "weekly", 1, "2025-05-28 18:00:00"), (journal, "Journal", "daily", 0, None)]
+    assert analytics.get_due_habits(at_risk_only=True, as_of=june(5)) == [
+        (walk, "Walk", "daily", 3, "2025-06-04 21:30:00"), (gym, "Gym", "weekly", 1, "2025-05-28 18:00:00")]
+    assert analytics.get_due_habits(at_risk_only=True, as_of=june(9)) == []
+
+    assert analytics.get_current_streak(walk, as_of=june(5)) == 3
+    assert analytics.get_current_streak(walk, as_of=june(6)) == 0
+    assert analytics.get_current_streak(walk, as_of=june(3)) == 2  # Before the last completion: from the bitmap
+    assert analytics.get_current_streak(journal) == 0
+
+#42 Streak segments are kept run-length encoded on every insert
+def test_streak_segments(clean_db):
+    """Compare incrementally maintained segments with a rebuild, then query them by range, length and date."""
+    analytics = Analytics(db=clean_db)
+    rng = random.Random(7)
+    start = datetime(2024, 1, 1, 9, 0, 0)
+    for index in range(6):
+        habit_id = clean_db.insert_habit(f"Habit {index}", "weekly" if index % 2 else "daily")
+        offsets = sorted(rng.sample(range(400), 150))
+        clean_db.insert_completions_bulk((habit_id, start + timedelta(days=offset)) for offset in offsets[:100])
+        for offset in rng.sample(offsets[100:], 50):  # Mostly out of order
+            clean_db.insert_completion_datetime(habit_id, start + timedelta(days=offset))
+
+    # A shuffled backfill in small chunks back-dates most habits in every chunk
+    history = [(habit_id, start + timedelta(days=offset, hours=rng.randint(0, 12)))
+               for habit_id in range(1, 7) for offset in rng.sample(range(400), 60)]
+    rng.shuffle(history)
+    clean_db.insert_completions_bulk(history, chunk_size=37)
+
+    segments_sql = "SELECT * FROM streak_segments ORDER BY habit_id, start_period"
+    state_sql = "SELECT * FROM habit_streak_state ORDER BY habit_id"
+    incremental = clean_db.conn.execute(segments_sql).fetchall(), clean_db.conn.execute(state_sql).fetchall()
+    db_manager._rebuild_streak_segments(clean_db.conn)
+    db_manager._rebuild_streak_state(clean_db.conn)
+    assert incremental == (clean_db.conn.execute(segments_sql).fetchall(), clean_db.conn.execute(state_sql).fetchall())
+    for habit_id, streak in analytics.get_longest_streaks(engine="sql").items():
+        assert max(length for _, _, length in analytics.get_streak_segments(habit_id)) == streak
+
+    habit_id = clean_db.insert_habit("Read", "daily")
+    for day in [1, 2, 3, 4, 10, 11, 30, 31]:
+        clean_db.insert_completion_datetime(habit_id, datetime(2024, 12, day, 8, 0, 0))
+    clean_db.insert_completion_datetime(habit_id, datetime(2025, 1, 1, 8, 0, 0))
+    day = lambda month, number: datetime(2024 + (month == 1), month, number).date()
+    assert analytics.get_streak_segments(habit_id) == [
+        (day(12, 1), day(12, 4), 4), (day(12, 10), day(12, 11), 2), (day(12, 30), day(1, 1), 3)]
+    assert analytics.get_streak_segments(habit_id, min_length=3) == [
+        (day(12, 1), day(12, 4), 4), (day(12, 30), day(1, 1), 3)]
+    # The primary key answers length filters too, so inserts maintain no other index
+    assert [index[1] for index in clean_db.conn.execute("PRAGMA index_list(streak_segments)")] == [
+        "sqlite_autoindex_streak_segments_1"]
+    assert analytics.get_longest_streak_between(habit_id, day(12, 3), day(12, 31)) == 2
+    assert analytics.get_streak_as_of(habit_id, day(12, 3)) == 3
+    assert analytics.get_streak_as_of(habit_id, day(12, 5)) == 4
+    assert analytics.get_streak_as_of(habit_id, day(12, 6)) == 0
+
+#43 Completion windows are answered from the index or from an in-memory timeline
+def test_completions_between(clean_db):
+    """Compare the SQL range queries with the bisect-backed timeline on the same windows."""
+    analytics = Analytics(db=clean_db)
+    habit_id = clean_db.insert_habit("Water plants", "daily")
+    other_id = clean_db.insert_habit("Call family", "weekly")
+    moments = [datetime(2025, 1, 1, 8, 0, 0) + timedelta(hours=13 * index) for index in range(100)]
+    clean_db.insert_completions_bulk([(habit_id, moment) for moment in moments] + [(other_id, moments[10])])
+
+    start, end = datetime(2025, 1, 10), datetime(2025, 1, 20)
+    expected = [moment for moment in moments if start <= moment < end]
+    assert clean_db.get_completions_between(habit_id, start, end) == [
+        (moment.strftime(TIMESTAMP_FORMAT),) for moment in expected]
+    assert clean_db.count_completions_between(habit_id, start, "2025-01-20 00:00:00") == len(expected)
+    assert clean_db.count_completions_between(habit_id, end, start) == 0
+
+    timeline = analytics.get_completion_timeline(habit_id)
+    assert len(timeline) == 100
+    assert timeline.between(start, end) == expected
+    assert timeline.count_between(start, end) == len(expected)
+    weeks = [datetime(2024, 12, 30) + timedelta(weeks=week) for week in range(10)]
+    assert timeline.count_windows(weeks) == [
+        clean_db.count_completions_between(habit_id, first, last) for first, last in zip(weeks, weeks[1:])]
+
+#44 Day, week and month rollups follow every insert and can be rebuilt in batches
+def test_completion_rollups(clean_db):
+    """Compare incrementally maintained rollups with a batched rebuild and with the raw completions."""
+    analytics = Analytics(db=clean_db)
+    rng = random.Random(3)
+    for index in range(5):
+        habit_id = clean_db.insert_habit(f"Habit {index}", "weekly" if index % 2 else "daily")
+        moments = [datetime(2024, 11, 1) + timedelta(minutes=rng.randint(0, 120 * 24 * 60)) for _ in range(60)]
+        clean_db.insert_completions_bulk([(habit_id, moment) for moment in moments[:40]], chunk_size=7)
+        for moment in moments[40:]:
+            clean_db.insert_completion_datetime(habit_id, moment)
+    clean_db.delete_habit(2)
+
+    maintained = {period: clean_db.get_completion_counts(period) for period in ("day", "week", "month")}
+    assert clean_db.rebuild_rollups(batch_size=2) == 4
+    assert {period: clean_db.get_completion_counts(period) for period in maintained} == maintained
+    assert {habit_id for habit_id, _, _ in maintained["day"]} == {1, 3, 4, 5}
+    assert sum(count for _, _, count in maintained["month"]) == 4 * 60
+
+    december = analytics.get_completion_counts("month", datetime(2024, 12, 1).date(), datetime(2024, 12, 31).date(), 1)
+    assert december == {1: [(datetime(2024, 12, 1).date(), clean_db.count_completions_between(
+        1, datetime(2024, 12, 1), datetime(2025, 1, 1)))]}
+    assert clean_db.get_completion_periods(1, "daily") == sorted({
+        parse_day_ordinal(row[0]) for row in clean_db.get_completion_dates(1)})
+    with pytest.raises(ValueError, match="Unknown period 'year'"):
+        clean_db.get_completion_counts("year")
+
+#45 Streak results are cached until a write changes the habits they depend on
+def test_persistent_analytics_cache(tmp_path, monkeypatch):
+    """Verify cache hits across connections, invalidation by writes and detection of other writers."""
+    path = str(tmp_path / "cache.db")
+    db = HabitDatabase(path)
+    walk = db.insert_habit("Walk", "daily")
+    read = db.insert_habit("Read", "daily")
+    for day in [1, 2, 3]:
+        db.insert_completion_datetime(walk, datetime(2025, 4, day, 8, 0, 0))
+    db.insert_completion_datetime(read, datetime(2025, 4, 1, 8, 0, 0))
+
+    computed = []
+    compute = Analytics._longest_streak_for_habit
+    monkeypatch.setattr(Analytics, "_longest_streak_for_habit",
+                        lambda self, habit_id, engine: computed.append(habit_id) or compute(self, habit_id, engine))
+    analytics = Analytics(db=db)
+    assert analytics.get_longest_streak_for_habit(walk, engine="sql") == 3
+    assert analytics.get_longest_streak_for_habit(walk, engine="sql") == 3  # From memory
+    assert computed == [walk]
+
+    # A new process finds the result in the cache table
+    other = HabitDatabase(path)
+    assert Analytics(db=other).get_longest_streak_for_habit(walk, engine="sql") == 3
+    assert computed == [walk]
+
+    # Writing to another habit keeps the entry; writing to this one invalidates it
+    db.insert_completion_datetime(read, datetime(2025, 4, 2, 8, 0, 0))
+    assert analytics.get_longest_streak_for_habit(walk, engine="sql") == 3
+    assert computed == [walk]
+    other.insert_completion_datetime(walk, datetime(2025, 4, 4, 8, 0, 0))  # Seen through data_version
+    assert analytics.get_longest_streak_for_habit(walk, engine="sql") == 4
+    assert computed == [walk, walk]
+
+    assert analytics.get_longest_streaks(engine="python") == {walk: 4, read: 2}
+    db.delete_habit(read)
+    assert analytics.get_longest_streaks(engine="python") == {walk: 4}
+    assert analytics.get_longest_streak(engine="python") == 4
+    other.close()
+    db.close()
+
+#46 The in-process LRU cache is bounded by entries and by bytes
+def test_lru_cache_limits():
+    """Verify eviction order, byte accounting and the counters."""
+    cache = LRUCache(max_entries=3, max_bytes=10**6)
+    for habit_id in (1, 2, 3):
+        cache.put((habit_id, "longest_streak", 0), habit_id)
+    assert cache.get((1, "longest_streak", 0)) == 1  # Now the most recently used
+    cache.put((4, "longest_streak", 0), 4)
+    assert (2, "longest_streak", 0) not in cache and (1, "longest_streak", 0) in cache
+    assert cache.get((2, "longest_streak", 0)) is None
+
+    cache.invalidate([1, 4])
+    assert len(cache) == 1 and cache.bytes == approximate_size(3)
+    assert cache.stats() == {"entries": 1, "bytes": approximate_size(3), "max_entries": 3, "max_bytes": 10**6,
+                             "hits": 1, "misses": 1, "evictions": 1, "invalidations": 2}
+
+    small = LRUCache(max_entries=100, max_bytes=2 * approximate_size(list(range(100))))
+    for habit_id in range(5):
+        small.put((habit_id, "periods", 0), list(range(100)))
+    assert len(small) == 2 and small.evictions == 3
+    with pytest.raises(ValueError):
+        LRUCache(max_entries=0)
+
+#47 Analytics reuses cached arrays until a HabitManager write invalidates them
+def test_analytics_memo_invalidation():
+    """Verify in-process hits for completion arrays and streaks, and the write hooks of HabitManager."""
+    with HabitSession(":memory:") as session:
+        manager, analytics = session.habit_manager, session.analytics
+        manager.create_habit("Run", "daily")
+        manager.mark_habits_completed_bulk([(1, datetime(2025, 5, day, 7, 0, 0)) for day in (1, 2, 3)])
+
+        assert analytics.get_longest_streak_for_habit(1, engine="array") == 3
+        hits = analytics.memo.hits
+        assert analytics.get_longest_streak_for_habit(1, engine="array") == 3
+        assert analytics.memo.hits == hits + 1
+        assert len(analytics.get_completion_timeline(1)) == 3
+        assert analytics.get_completion_timeline(1) is analytics.get_completion_timeline(1)
+
+        invalidations = analytics.memo.invalidations
+        manager.mark_habit_completed(1, datetime(2025, 5, 4, 7, 0, 0))
+        assert analytics.memo.invalidations > invalidations
+        assert len(analytics.get_completion_timeline(1)) == 4
+        assert analytics.get_longest_streaks(engine="python") == {1: 4}
+        assert analytics.get_longest_streak_for_habit(1, engine="array") == 4
+
+#48 Parallel analytics split habits into contiguous ranges and merge deterministically
+def test_parallel_longest_streaks(tmp_path):
+    """Compare the process pool with the serial engine for several worker counts."""
+    assert habit_id_ranges([5, 1, 2, 9, 7], 2) == [(1, 2), (5, 9)]
+    assert habit_id_ranges([3], 4) == [(3, 3)]
+    assert habit_id_ranges([], 4) == []
+
+    path = str(tmp_path / "fleet.db")
+    db = HabitDatabase(path)
+    rng = random.Random(11)
+    for index in range(30):
+        habit_id = db.insert_habit(f"Habit {index}", "weekly" if index % 4 == 0 else "daily")
+        days = rng.sample(range(200), rng.randint(0, 40))
+        db.insert_completions_bulk((habit_id, datetime(2024, 1, 1, 12, 0, 0) + timedelta(days=day)) for day in days)
+    expected = Analytics(db, cache=False).get_longest_streaks(engine="sql")
+
+    for workers in (1, 3):
+        assert list(Analytics(db, cache=False).get_longest_streaks_parallel(workers).items()) == list(expected.items())
+    with pytest.raises(ValueError, match="database file"):
+        Analytics(HabitDatabase(":memory:")).get_longest_streaks_parallel(2)
+    db.close()
+
+#49 Fleet analytics reduce many database files to the same totals however they are grouped
+def test_fleet_summary(tmp_path):
+    """Summarize several database files by glob, in one ATTACH group and across worker processes."""
+    rng = random.Random(5)
+    expected_streak, expected_completions, expected_habits = 0, 0, {"daily": 0, "weekly": 0}
+    for team in range(5):
+        path = str(tmp_path / f"team{team}.db")
+        db = HabitDatabase(path)
+        for index in range(team + 2):
+            periodicity = "weekly" if index % 3 == 0 else "daily"
+            habit_id = db.insert_habit(f"Habit {index}", periodicity)
+            days = rng.sample(range(120), rng.randint(0, 30))
+            db.insert_completions_bulk((habit_id, datetime(2024, 1, 1, 9, 0, 0) + timedelta(days=day)) for day in days)
+            expected_habits[periodicity] += 1
+            expected_completions += len(days)
+        expected_streak = max(expected_streak, Analytics(db, cache=False).get_longest_streak(engine="sql"))
+        db.close()
+
+    summary = Analytics.fleet_summary(str(tmp_path / "*.db"), workers=1)
+    assert summary["databases"] == 5
+    assert summary["habits"] == 20
+    assert summary["habits_by_periodicity"] == expected_habits
+    assert summary["completions"] == expected_completions
+    assert summary["longest_streak"] == expected_streak
+    assert summary["longest_streak_habit"][0].endswith(".db")
+    assert Analytics.fleet_summary(str(tmp_path / "*.db"), workers=2, group_size=2) == summary
+
+    with pytest.raises(ValueError, match="No database files"):
+        Analytics.fleet_summary(str(tmp_path / "*.sqlite"))
+    HabitDatabase(str(tmp_path / "old.db"), migrate=False).close()
+    with pytest.raises(ValueError, match="schema version 0"):
+        Analytics.fleet_summary(str(tmp_path / "*.db"))
+
+#50 The asyncio facade runs reads concurrently on reader threads and writes on one writer thread
+def test_async_habit_database(tmp_path):
+    """Write through the writer thread, then read and analyze concurrently from the event loop."""
+    public = {name for name in vars(HabitDatabase) if not name.startswith("_")}
+    assert public - set(READ_METHODS) - set(WRITE_METHODS) == {"transaction", "create_tables", "iter_completions", "close"}
+
+    async def scenario():
+        async with AsyncHabitDatabase(str(tmp_path / "async.db"), readers=3, profile="balanced") as adb:
+            habit_ids = await asyncio.gather(*(adb.insert_habit(f"Habit {index}", "daily") for index in range(6)))
+            assert sorted(habit_ids) == list(range(1, 7))
+            await asyncio.gather(*(adb.insert_completions_bulk(
+                [(habit_id, datetime(2024, 3, day, 8, 0, 0)) for day in range(1, habit_id + 1)])
+                for habit_id in habit_ids))
+            streaks = await asyncio.gather(*(adb.read(
+                lambda db, habit_id: Analytics(db, cache=False).get_longest_streak_for_habit(habit_id, engine="sql"),
+                habit_id) for habit_id in habit_ids))
+            assert streaks == habit_ids
+            assert await adb.get_max_longest_streak() == 6
+            assert len(await adb.get_completion_dates(4)) == 4
+
+            with pytest.raises(ValueError, match="already exists"):
+                await adb.insert_habit("Habit 0", "daily")
+            with pytest.raises(ZeroDivisionError):
+                await adb.write(lambda db: (db.delete_habit(1), 1 / 0))
+            assert await adb.get_habit_by_id(1) is not None  # Rolled back with the failed unit of work
+        with pytest.raises(ValueError, match="closed"):
+            await adb.get_habits()
+
+    asyncio.run(scenario())
+    with pytest.raises(ValueError, match="database file"):
+        AsyncHabitDatabase(":memory:")
+
+#51 The streak state migration backfills the table at its own schema version
+def test_streak_state_migration_backfills_at_version_4(tmp_path):
+    """Stop migrating at version 4, as a release of that version did, then finish the migrations."""
+    db = HabitDatabase(str(tmp_path / "v4.db"), migrate=False)
+    db.conn.execute("INSERT INTO habits (name, periodicity, creation_date) VALUES ('Walk', 'daily', '2025-01-01')")
+    db.conn.executemany("INSERT INTO completion_dates (habit_id, completion_datetime) VALUES (1, ?)",
+                        [("2025-01-06 09:00:00",), ("2025-01-07 08:30:00",)])
+    db.conn.commit()
+    january_7 = datetime(2025, 1, 7).toordinal()
+
+    for version, _, step in db_manager.MIGRATIONS[:4]:
+        with db.transaction():
+            step(db.conn)
+            db.conn.execute(f"PRAGMA user_version = {version}")
+    assert db.get_streak_state(1) == (january_7, 2, 2)
+
+    db.migrate()
+    assert db.get_schema_version() == SCHEMA_VERSION
+    assert db.get_streak_state(1) == (january_7, 2, 2)
+    assert db.get_due_habits(january_7 + 1)[0][4] == "2025-01-07 08:30:00"  # last_completion filled by version 6
+    db.close()
+
+#52 Results computed inside a unit of work that rolls back are not served afterwards
+def test_analytics_cache_forgets_rolled_back_writes(tmp_path):
+    """Complete a habit and read its streak in a failing unit of work, then read it again."""
+    with HabitSession(str(tmp_path / "rollback.db")) as session:
+        session.habit_manager.create_habit("Stretch", "daily")
+        for day in range(1, 4):
+            session.habit_manager.mark_habit_completed(1, datetime(2025, 3, day, 7, 0, 0))
+
+        with pytest.raises(RuntimeError):
+            with session.unit_of_work():
+                session.habit_manager.mark_habit_completed(1, datetime(2025, 3, 4, 7, 0, 0))
+                assert session.analytics.get_longest_streak_for_habit(1, "sql") == 4
+                assert session.analytics.get_longest_streak_for_habit(1, "python") == 4
+                raise RuntimeError("abort")
+        assert len(session.db.get_completion_dates(1)) == 3
+        assert session.analytics.get_longest_streak_for_habit(1, "sql") == 3
+        assert session.analytics.get_longest_streak_for_habit(1, "python") == 3  # Memoized periods
+
+        # A savepoint rolled back inside a unit of work that goes on
+        with session.unit_of_work():
+            with pytest.raises(RuntimeError):
+                with session.unit_of_work():
+                    session.habit_manager.mark_habit_completed(1, datetime(2025, 3, 4, 7, 0, 0))
+                    assert session.analytics.get_completion_timeline(1).count_between(
+                        datetime(2025, 3, 1), datetime(2025, 3, 5)) == 4
+                    raise RuntimeError("abort")
+            assert session.analytics.get_completion_timeline(1).count_between(
+                datetime(2025, 3, 1), datetime(2025, 3, 5)) == 3
+            # The version reused by the next write must not match the rolled-back results
+            session.habit_manager.mark_habit_completed(1, datetime(2025, 3, 6, 7, 0, 0))
+            assert session.analytics.get_longest_streak_for_habit(1, "sql") == 3
+
+#53 Parallel streaks never cache what the workers read from an older snapshot
+def test_parallel_longest_streaks_see_pending_writes(tmp_path):
+    """Run parallel streaks inside a unit of work with uncommitted completions, then read the cache after the commit."""
+    path = str(tmp_path / "pending.db")
+    with HabitSession(path) as session:
+        session.habit_manager.create_habit("Walk", "daily")
+        session.habit_manager.mark_habit_completed(1, datetime(2025, 1, 1, 8, 0, 0))
+        with session.unit_of_work():
+            for day in (2, 3):
+                session.habit_manager.mark_habit_completed(1, datetime(2025, 1, day, 8, 0, 0))
+            assert session.analytics.get_longest_streaks_parallel(2) == {1: 3}
+        assert session.analytics.get_longest_streaks("stream") == {1: 3}
+        assert session.analytics.get_longest_streaks_parallel(2) == {1: 3}  # No pending writes
+    with HabitSession(path) as session:
+        assert session.analytics.get_longest_streaks("stream") == {1: 3}
+        assert session.analytics.get_longest_streaks("sql") == {1: 3}
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+# Completion timestamps are naive wall-clock times in this format.
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_UNIX_EPOCH = datetime(1970, 1, 1)
+
+# Day ordinal of 1970-01-01, the origin of the stored epoch seconds.
+_EPOCH_ORDINAL = _UNIX_EPOCH.toordinal()
+
+
+def parse_timestamp(timestamp):
+    """
+    Parse a "YYYY-MM-DD HH:MM:SS" string into a datetime.
+
+    Well-formed strings take the C-level datetime.fromisoformat path. Anything else is
+    handed to datetime.strptime, so the accepted inputs and the ValueError messages are
+    exactly those of strptime with TIMESTAMP_FORMAT, only much faster on valid data.
+
+    Args:
+        timestamp (str): The timestamp to parse.
+
+    Returns:
+        datetime: The parsed, naive datetime.
+    """
+    # fromisoformat also accepts other ISO 8601 shapes, so only use it for this exact layout
+    if (len(timestamp) == 19 and timestamp[10] == " " and timestamp[4] == timestamp[7] == "-"
+            and timestamp[13] == timestamp[16] == ":"):
+        try:
+            return datetime.fromisoformat(timestamp)
+        except ValueError:
+            pass
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+
+
+def parse_day_ordinal(timestamp):
+    """Parse a "YYYY-MM-DD HH:MM:SS" string straight to its day ordinal (date.toordinal())."""
+    return parse_timestamp(timestamp).toordinal()
+
+
+def week_ordinal(day_ordinal):
+    """
+    Convert a day ordinal (date.toordinal()) into an ISO-week ordinal.
+
+    Day ordinal 1 (0001-01-01) is a Monday, so every ISO week maps to one integer
+    and consecutive weeks map to consecutive integers, across years with 52 or 53 weeks.
+    """
+    return (day_ordinal - 1) // 7
+
+
+def month_ordinal(day_ordinal):
+    """Convert a day ordinal into a month ordinal, year * 12 + month - 1, consecutive across years."""
+    day = datetime.fromordinal(day_ordinal)
+    return day.year * 12 + day.month - 1
+
+
+def encode_completion(completion_datetime):
+    """
+    Convert a completion timestamp into its stored integer columns.
+
+    Args:
+        completion_datetime (datetime or str): The completion time, as a datetime or
+            a "YYYY-MM-DD HH:MM:SS" string.
+
+    Returns:
+        tuple: (epoch seconds, day ordinal, ISO-week ordinal). The epoch counts
+        wall-clock seconds since 1970-01-01 00:00:00 without any timezone conversion.
+    """
+    if isinstance(completion_datetime, str):
+        completion_datetime = parse_timestamp(completion_datetime)
+    day = completion_datetime.toordinal()
+    epoch = ((day - _EPOCH_ORDINAL) * 86400 + completion_datetime.hour * 3600
+             + completion_datetime.minute * 60 + completion_datetime.second)
+    return epoch, day, week_ordinal(day)
+
+
+def decode_epoch(epoch):
+    """Convert stored epoch seconds back into the naive wall-clock datetime they encode."""
+    return _UNIX_EPOCH + timedelta(seconds=epoch)